@@ -8,7 +8,10 @@ from .trec_topics import TrecTopics
 from .trec_terrier import TrecTerrier
 from .trec_indri import TrecIndri
 from .trec_pool_maker import TrecPoolMaker
+from .trec_adaptive_pool import TrecAdaptivePool
+from .trec_relevance_matrix import TrecQrelIndex, TrecRelevanceMatrix
 from .trec_eval import TrecEval
+from .trec_incremental_eval import TrecIncrementalEval
 
-__all__ = ["TrecRes", "TrecQrel", "TrecRun", "TrecPool", "TrecTopics", "TrecTerrier", "TrecIndri", "TrecEval", "TrecPoolMaker"]
+__all__ = ["TrecRes", "TrecQrel", "TrecRun", "TrecPool", "TrecTopics", "TrecTerrier", "TrecIndri", "TrecEval", "TrecIncrementalEval", "TrecPoolMaker", "TrecAdaptivePool", "TrecQrelIndex", "TrecRelevanceMatrix"]
 
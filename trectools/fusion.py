@@ -1,9 +1,11 @@
+import os
 import sys
 import pandas as pd
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
-from functools import reduce
+import scipy.sparse as sparse
+from concurrent.futures import ProcessPoolExecutor
 from trectools import TrecRun
+from trectools.trec_run import align_topics, read_run_by_topic
 
 
 # TODOs:
@@ -11,7 +13,7 @@ from trectools import TrecRun
 # (2) All functions here follow the same structure with a nested for per-topic and per-document, this is not necessary.
 #     The same could be done with a groupby(topics).apply(func)
 
-def combos(trec_runs, strategy="sum", max_docs=1000):
+def combos(trec_runs, strategy="sum", max_docs=1000, backend="dense", normalization=None):
     """
         Implements a many of the traditional score fusion methods. Use the parameter strategy to pick a method.
 
@@ -19,35 +21,30 @@ def combos(trec_runs, strategy="sum", max_docs=1000):
             trec_runs: a list of TrecRun objects to fuse
            strategy: "sum", "max", "min", "anz", "mnz", "med"
             max_docs: can be either a single integer or a dict{qid,value}
+            backend: "dense" keeps the scores in a (documents x runs) matrix, "sparse" in a scipy.sparse CSR matrix,
+                     which only needs memory for the documents retrieved by each run. Use it to fuse hundreds of runs.
+                     Both give the same results. Default = "dense"
+            normalization: normalizes the scores of each run before fusing them, see normalize_runs. Default = None (raw scores)
     """
-    dfs = []
-    for t in trec_runs:
-        dfs.append(t.run_data)
-
-    # Merge all runs
-    """
-    merged = reduce(lambda left,right: pd.merge(left, right, right_on=["query","docid"], left_on=["query","docid"], how="outer",
-        suffixes=("","_")), dfs)
-    merged = merged[["query", "docid", "score", "score_"]]
-    """
-
-    if len(dfs) < 2:
+    if len(trec_runs) < 2:
         return
 
-    merged = pd.merge(dfs[0], dfs[1], right_on=["query", "docid"], left_on=["query", "docid"], how="outer", suffixes=("", "_"))
-    merged = merged[["query", "q0", "docid", "score", "score_"]]
-
-    for d in dfs[2:]:
-        merged = pd.merge(merged, d, right_on=["query", "docid"], left_on=["query", "docid"], how="outer", suffixes=("", "_"))
-        merged = merged[["query", "q0", "docid", "score", "score_"]]
+    if strategy not in ["sum", "max", "min", "anz", "mnz", "med"]:
+        print("Unknown strategy %s. Options are: 'sum', 'max', 'min', 'anz', 'mnz'" % (strategy))
+        return None
 
-    # merged["query"] = merged["query"].astype(str).apply(lambda x:x.strip())
-    # return merged
+    # Use normalization="rank" or "borda" to act on the rank of documents instead of their scores
+    if normalization is not None:
+        trec_runs = normalize_runs(trec_runs, normalization)
 
-    # merged.fillna(0.0, inplace=True) <- not filling nan's. Instead, I am using np.nan* functions
-    # TODO: add option to normalize values
-    # TODO: add option to act on the rank of documents instead of their scores
+    if backend == "sparse":
+        documents, scores = _sparse_score_matrix(trec_runs)
+        documents["score"] = _reduce_sparse_rows(scores, strategy)
+        return _ranking_to_run(documents, max_docs, "comb_%s" % strategy)
+    elif backend != "dense":
+        raise ValueError('Unknown backend "%s". Options are "dense" and "sparse".' % (backend))
 
+    # Not filling nan's. Instead, I am using np.nan* functions over the runs of each document
     if strategy == "sum":
         merge_func = np.nansum
     elif strategy == "max":
@@ -57,80 +54,353 @@ def combos(trec_runs, strategy="sum", max_docs=1000):
     elif strategy == "anz":
         merge_func = np.nanmean
     elif strategy == "mnz":
-        def mnz(values):
-            n_valid_entries = np.sum(~np.isnan(values))
-            return np.nansum(values) * n_valid_entries
+        def mnz(values, axis):
+            n_valid_entries = np.sum(~np.isnan(values), axis=axis)
+            return np.nansum(values, axis=axis) * n_valid_entries
         merge_func = mnz
     elif strategy == "med":
         merge_func = np.nanmedian
-    else:
-        print("Unknown strategy %s. Options are: 'sum', 'max', 'min', 'anz', 'mnz'" % (strategy))
-        return None
 
-    merged["ans"] = merged[["score", "score_"]].apply(merge_func, raw=True, axis=1)
-    merged.sort_values(["query", "ans"], ascending=[True, False], inplace=True)
+    documents, scores = _score_matrix(trec_runs)
+    documents["score"] = merge_func(scores, axis=1)
 
-    rows = []
-    for topic in merged['query'].unique():
-        merged_topic = merged[merged['query'] == topic]
-        if type(max_docs) == dict:
-            maxd = max_docs[topic]
-            for rank, (docid, score) in enumerate(merged_topic[["docid", "ans"]].head(maxd).values, start=1):
-                rows.append((topic, "Q0", docid, rank, score, "comb_%s" % strategy))
-        else:
-            for rank, (docid, score) in enumerate(merged_topic[["docid", "ans"]].head(max_docs).values, start=1):
-                rows.append((topic, "Q0", docid, rank, score, "comb_%s" % strategy))
+    return _ranking_to_run(documents, max_docs, "comb_%s" % strategy)
 
-    merged_run = TrecRun(None)
-    df = pd.DataFrame(rows)
-    df.columns = ["query", "q0", "docid", "rank", "score", "system"]
-    merged_run.load_run_from_dataframe(df)
 
-    return merged_run
+def weighted_fusion(trec_runs, weights, max_docs=1000, normalization=None):
+    """
+        Implements a weighted linear fusion: the score of a document is the weighted sum of its scores in the runs
+        (0 in runs that did not retrieve it). See optimize_fusion_weights to learn the weights.
 
+        Parameters:
+            trec_runs: a list of TrecRun objects to fuse
+            weights: a list with one weight per run
+            max_docs: can be either a single integer or a dict{qid,value}
+            normalization: normalizes the scores of each run before fusing them, see normalize_runs. Default = None (raw scores)
+    """
+    if len(weights) != len(trec_runs):
+        raise ValueError("Expected %d weights, one per run, but got %d." % (len(trec_runs), len(weights)))
 
-def vector_space_fusion(trec_runs, max_docs=1000):
+    if normalization is not None:
+        trec_runs = normalize_runs(trec_runs, normalization)
+
+    documents, scores = _sparse_score_matrix(trec_runs)
+    documents["score"] = scores @ np.asarray(weights, dtype=float)
+
+    return _ranking_to_run(documents, max_docs, "weighted_fusion")
+
+
+def optimize_fusion_weights(trec_runs, trec_qrel, weights=None, n_samples=1000, metric="map", depth=1000,
+                            normalization=None, max_docs=1000, batch_size=256, random_state=None):
     """
-        Implements a simple vector space fusion with the nearest neighbors algorithm.
+        Searches the weights of weighted_fusion that maximize MAP or NDCG against a qrel.
+        The scores of the runs and the relevance of their documents are aligned only once, then every candidate
+        weight vector is evaluated with matrix products, many candidates at a time.
+        Values are the same as TrecEval.get_map and TrecEval.get_ndcg (with trec_eval=True) of the fused run.
 
         Parameters:
             trec_runs: a list of TrecRun objects to fuse
-            max_docs: maximum number of documents in the final ranking
+            trec_qrel: a TrecQrel object
+            weights: a matrix (candidates x runs) with the weights to try, e.g., a grid.
+                     Default = None, i.e., n_samples random weight vectors that sum up to one.
+            n_samples: number of random weight vectors, only used if weights is None
+            metric: "map" or "ndcg"
+            depth: the evaluation depth
+            normalization: normalizes the scores of each run before fusing them, see normalize_runs. Default = None (raw scores)
+            max_docs: maximum number of documents in the fused run
+            batch_size: number of candidates evaluated together
+            random_state: seed for the random weights
+
+        Returns the best weights and the fused TrecRun created with them.
+    """
+    if metric not in ["map", "ndcg"]:
+        raise ValueError('Unknown metric "%s". Options are "map" and "ndcg".' % (metric))
+
+    if normalization is not None:
+        trec_runs = normalize_runs(trec_runs, normalization)
+
+    if weights is None:
+        weights = np.random.RandomState(random_state).dirichlet(np.ones(len(trec_runs)), n_samples)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if weights.shape[1] != len(trec_runs):
+        raise ValueError("Expected %d weights, one per run, but got %d." % (len(trec_runs), weights.shape[1]))
+
+    values = _evaluate_weights(trec_runs, trec_qrel, weights, metric, depth, batch_size)
+    best = weights[np.argmax(values)]
+    return best, weighted_fusion(trec_runs, best, max_docs=max_docs)
+
+
+def _evaluate_weights(trec_runs, trec_qrel, weights, metric, depth, batch_size):
+    """
+        Returns the MAP or NDCG of the weighted fusion of trec_runs with each weight vector (row) of 'weights'.
+    """
+    documents, scores = _sparse_score_matrix(trec_runs)
+    qrels_index = trec_qrel.get_qrels_index()
+    rels = qrels_index.get_judgements(documents["query"].values, documents["docid"].values)
+    gains = np.where(rels > 0, rels, 0.)
+
+    # Documents of each topic in docid order, so that a stable sort by score breaks ties by docid
+    documents = documents.sort_values(["query", "docid"], kind="stable")
+    order = documents.index.values
+    topics, bounds = np.unique(documents["query"].values, return_index=True)
+    bounds = list(bounds) + [len(order)]
+
+    nrel = qrels_index.relevant_per_query.reindex(topics).fillna(0).astype(int).values
+    rows = qrels_index.get_query_rows(topics)
+    discount = 1. / np.log2(np.arange(2, depth + 2))
+
+    values = np.zeros(weights.shape[0])
+    for t in range(len(topics)):
+        topic_docs = order[bounds[t]:bounds[t + 1]]
+        topic_scores = scores[topic_docs]
+        topic_gains = gains[topic_docs]
+        nrel_at_depth = min(nrel[t], depth)
+        if nrel_at_depth == 0:
+            # Topics without relevant documents count as 0, as in TrecEval
+            continue
+
+        for begin in range(0, weights.shape[0], batch_size):
+            fused = topic_scores @ weights[begin:begin + batch_size].T
+            if metric == "map":
+                # trec_eval breaks ties by docid in decreasing order
+                ranking = np.argsort(-fused[::-1], axis=0, kind="stable")[:depth]
+                hits = (topic_gains[::-1][ranking] > 0)
+                precision = np.cumsum(hits, axis=0) / np.arange(1, ranking.shape[0] + 1)[:, None]
+                values[begin:begin + batch_size] += (precision * hits).sum(axis=0) / nrel_at_depth
+            else:
+                # NDCG keeps the order of the fused run, where ties are broken by docid in increasing order
+                ranking = np.argsort(-fused, axis=0, kind="stable")[:depth]
+                dcg = (topic_gains[ranking] * discount[:ranking.shape[0], None]).sum(axis=0)
+                values[begin:begin + batch_size] += dcg / qrels_index.ideal_dcg[rows[t], nrel_at_depth - 1]
+
+    # Average over all topics of the runs
+    return values / len(topics)
+
+
+def normalize_runs(trec_runs, method="minmax"):
+    """
+        Normalizes the scores of each topic of each run, so that runs with different score ranges can be fused.
+        All runs are normalized at once.
+
+        Parameters:
+            trec_runs: a list of TrecRun objects
+            method: "minmax": (score - min) / (max - min). 1.0 if all scores of the topic are the same.
+                    "zscore": (score - mean) / standard deviation. 0.0 if all scores of the topic are the same.
+                    "sum": score / sum of the scores, so that the scores of a topic sum up to one.
+                           1 / number of documents if the scores sum up to zero.
+                    "rank": 1 - (rank - 1) / number of documents, where rank is the position of the document by score.
+                    "borda": number of documents - rank + 1, i.e., Borda count points.
+
+        Returns a list with a new TrecRun for each run.
+    """
+    run_data, run_ids = _concat_runs(trec_runs, ["query", "score"])
+    query_codes, query_names = pd.factorize(run_data["query"])
+    scores = run_data["score"].astype(float)
+    grouped = scores.groupby(run_ids * len(query_names) + query_codes)
+
+    if method == "minmax":
+        minimum = grouped.transform("min").values
+        score_range = grouped.transform("max").values - minimum
+        normalized = np.where(score_range > 0, (scores.values - minimum) / np.where(score_range > 0, score_range, 1.), 1.)
+    elif method == "zscore":
+        deviation = scores.values - grouped.transform("mean").values
+        std = np.sqrt(pd.Series(deviation ** 2).groupby(grouped.ngroup().values).transform("mean").values)
+        normalized = np.where(std > 0, deviation / np.where(std > 0, std, 1.), 0.)
+    elif method == "sum":
+        total = grouped.transform("sum").values
+        normalized = np.where(total != 0, scores.values / np.where(total != 0, total, 1.), 1. / grouped.transform("count").values)
+    elif method in ["rank", "borda"]:
+        ranks = grouped.rank(method="first", ascending=False).values
+        ndocs = grouped.transform("count").values
+        normalized = 1. - (ranks - 1) / ndocs if method == "rank" else ndocs - ranks + 1
+    else:
+        raise ValueError('Unknown normalization "%s". Options are "minmax", "zscore", "sum", "rank" and "borda".' % (method))
+
+    normalized_runs = []
+    ends = np.cumsum([r.run_data.shape[0] for r in trec_runs])
+    for r, end in zip(trec_runs, ends):
+        df = r.run_data.copy()
+        df["score"] = normalized[end - df.shape[0]:end]
+        normalized_run = TrecRun(None)
+        normalized_run.load_run_from_dataframe(df)
+        normalized_runs.append(normalized_run)
+
+    return normalized_runs
+
+
+def _score_matrix(trec_runs):
+    """
+        Puts the scores of all runs in a single matrix.
+
+        Returns a dataframe with the (query, docid) pairs retrieved by any of the runs and a float matrix
+        (pairs x runs) with the score of each pair in each run, NaN where the run did not retrieve the document.
+    """
+    run_data, run_ids = _concat_runs(trec_runs, ["query", "docid", "score"])
+    query_codes, query_names = pd.factorize(run_data["query"])
+    pair_codes, documents = _intern_pairs(query_codes, query_names, run_data["docid"])
+
+    scores = np.full((len(documents), len(trec_runs)), np.nan)
+    scores[pair_codes, run_ids] = run_data["score"].values.astype(float)
+
+    return documents, scores
+
+
+def _sparse_score_matrix(trec_runs, column="score"):
+    """
+        Same as _score_matrix, but the matrix is a scipy.sparse CSR matrix (pairs x runs) that only stores the
+        documents retrieved by each run. 'column' picks the values stored, e.g., "score" or "rank".
+        Documents are sorted by run inside each row of the matrix.
+    """
+    run_data, run_ids = _concat_runs(trec_runs, ["query", "docid", column])
+    query_codes, query_names = pd.factorize(run_data["query"])
+    pair_codes, documents = _intern_pairs(query_codes, query_names, run_data["docid"])
+
+    # Explicit zeros are kept, they are scores as any other
+    shape = (len(documents), len(trec_runs))
+    values = sparse.csr_matrix((run_data[column].values.astype(float), (pair_codes, run_ids)), shape=shape)
+
+    if values.nnz < len(run_data):
+        # Repeated documents in a run were summed up. As in the dense matrix, the last value has to win instead
+        cells = pair_codes.astype(np.int64) * len(trec_runs) + run_ids
+        last = ~pd.Series(cells).duplicated(keep="last").values
+        values = sparse.csr_matrix((run_data[column].values[last].astype(float), (pair_codes[last], run_ids[last])),
+                                   shape=shape)
+
+    values.sort_indices()
+    return documents, values
+
+
+def _reduce_sparse_rows(values, strategy):
+    """
+        Applies a combos strategy to each row of a CSR matrix, only over the values stored in the row.
+    """
+    counts = np.diff(values.indptr)
+    starts = values.indptr[:-1]
+
+    if strategy in ["sum", "anz", "mnz"]:
+        sums = values @ np.ones(values.shape[1])
+        if strategy == "anz":
+            return sums / counts
+        if strategy == "mnz":
+            return sums * counts
+        return sums
+    elif strategy == "max":
+        return np.maximum.reduceat(values.data, starts)
+    elif strategy == "min":
+        return np.minimum.reduceat(values.data, starts)
+    elif strategy == "med":
+        # Sort the values inside each row: first by value, then (stable) by row
+        rows = np.repeat(np.arange(values.shape[0]), counts)
+        order = np.argsort(values.data)
+        ordered = values.data[order[np.argsort(rows[order], kind="stable")]]
+        return (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2.
+
+
+def _concat_runs(trec_runs, columns):
+    """
+        Returns the given columns of all runs in a single dataframe and an array with the run (0..N-1) of each row.
+    """
+    run_data = pd.concat([r.run_data[columns] for r in trec_runs], ignore_index=True)
+    run_ids = np.repeat(np.arange(len(trec_runs)), [r.run_data.shape[0] for r in trec_runs])
+    return run_data, run_ids
+
+
+def _intern_pairs(query_codes, query_names, docids):
+    """
+        Gives an integer code to each distinct (query, docid) pair, in order of first appearance.
+        Queries are given already factorized, i.e., query_names[query_codes] are the queries of the rows.
+
+        Returns the code of each row and a dataframe with cols (query, docid) with the pair of each code.
+    """
+    doc_codes, doc_names = pd.factorize(docids)
+    pair_codes, pairs = pd.factorize(query_codes.astype(np.int64) * len(doc_names) + doc_codes)
+
+    documents = pd.DataFrame({"query": np.asarray(query_names)[pairs // len(doc_names)],
+                              "docid": np.asarray(doc_names)[pairs % len(doc_names)]})
+    return pair_codes, documents
+
+
+def _run_positions(trec_runs, depth=1000):
     """
+        Returns the top 'depth' documents of each topic of every run as flat arrays:
+        query codes (see pd.factorize), query names, docids, run (0..N-1) and the position of the document
+        in its run (starting at 1), as in TrecRun.get_top_documents.
+    """
+    run_data, run_ids = _concat_runs(trec_runs, ["query", "docid"])
+    query_codes, query_names = pd.factorize(run_data["query"])
+
+    # Position of each document inside its run and topic
+    groups = run_ids * len(query_names) + query_codes
+    positions = pd.Series(groups).groupby(groups, sort=False).cumcount().values + 1
+    top = positions <= depth
 
-    dfs = []
-    for t in trec_runs:
-        dfs.append(t.run_data)
+    return query_codes[top], query_names, run_data["docid"].values[top], run_ids[top], positions[top]
 
-    # Merge all runs
-    merged = reduce(lambda left, right: pd.merge(left, right, right_on=["query", "docid"], left_on=["query", "docid"], how="outer",
-                                                 suffixes=("", "_")), dfs)
-    merged = merged[["query", "docid", "score", "score_"]]
-    merged.fillna(0.0, inplace=True)
 
-    rows = []
-    for topic in merged["query"].unique():
+def _rank_fusion(trec_runs, contribution, max_docs, system, depth=1000):
+    """
+        Fuses the top 'depth' documents of each run by summing contribution(position) over the runs.
+
+        Returns a new TrecRun.
+    """
+    query_codes, query_names, docids, run_ids, positions = _run_positions(trec_runs, depth)
+    pair_codes, documents = _intern_pairs(query_codes, query_names, docids)
+    documents["score"] = np.bincount(pair_codes, weights=contribution(positions), minlength=len(documents))
+
+    return _ranking_to_run(documents, max_docs, system)
 
-        mtopic = merged[merged["query"] == topic]
-        nbrs = NearestNeighbors(n_neighbors=mtopic.shape[0], algorithm='ball_tree').fit(mtopic[["score", "score_"]].values)
 
-        pivot = mtopic.loc[mtopic["score"].idxmax()][["score", "score_"]].values
-        dists, order = nbrs.kneighbors(pivot.reshape(1, -1))
+def _ranking_to_run(documents, max_docs, system):
+    """
+        Sorts the (query, docid, score) rows of 'documents' by score inside each query (ties are broken by docid)
+        and keeps the first max_docs documents of each query.
+        max_docs can be either a single integer or a dict{qid,value}
 
-        docs = mtopic["docid"].values[order[0]]
-        scores = 1.0 / (dists + 0.1)
+        Returns a new TrecRun.
+    """
+    documents = documents.sort_values(["query", "score", "docid"], ascending=[True, False, True], kind="stable")
+    documents["rank"] = documents.groupby("query", observed=True).cumcount().values + 1
 
-        # Saves information for this topic
-        for rank, (docid, score) in enumerate(list(zip(docs, scores[0]))[:max_docs], start=1):
-            rows.append((topic, "Q0", docid, rank, score, "vector_space_fusion"))
+    if type(max_docs) == dict:
+        documents = documents[documents["rank"] <= documents["query"].map(max_docs)]
+    else:
+        documents = documents[documents["rank"] <= max_docs]
 
+    df = pd.DataFrame({"query": documents["query"].values, "q0": "Q0", "docid": documents["docid"].values,
+                       "rank": documents["rank"].values, "score": documents["score"].values, "system": system})
     merged_run = TrecRun(None)
-    df = pd.DataFrame(rows)
-    df.columns = ["query", "q0", "docid", "rank", "score", "system"]
     merged_run.load_run_from_dataframe(df)
 
     return merged_run
 
+
+def vector_space_fusion(trec_runs, max_docs=1000):
+    """
+        Implements a simple vector space fusion: each document is a point with one dimension per run (its score in
+        the run, 0 if not retrieved). In each topic, documents are ranked by their distance to the document
+        with the highest score in the first run.
+
+        Parameters:
+            trec_runs: a list of TrecRun objects to fuse
+            max_docs: maximum number of documents in the final ranking
+    """
+
+    documents, scores = _score_matrix(trec_runs)
+    scores = np.nan_to_num(scores, nan=0.0)
+
+    # The pivot of each topic is its document with the highest score in the first run
+    documents["first_score"] = scores[:, 0]
+    pivots = documents.sort_values(["query", "first_score", "docid"], ascending=[True, False, True]).drop_duplicates("query")
+    pivot_rows = pd.Series(pivots.index.values, index=pivots["query"].values)[documents["query"].values].values
+
+    # Euclidean distance of every document to the pivot of its topic
+    dists = np.sqrt(((scores - scores[pivot_rows]) ** 2).sum(axis=1))
+    documents = documents[["query", "docid"]].copy()
+    documents["score"] = 1.0 / (dists + 0.1)
+
+    return _ranking_to_run(documents, max_docs, "vector_space_fusion")
+
+
 def reciprocal_rank_fusion(trec_runs, k=60, max_docs=1000):
     """
         Implements a reciprocal rank fusion as define in
@@ -142,71 +412,157 @@ def reciprocal_rank_fusion(trec_runs, k=60, max_docs=1000):
             max_docs: maximum number of documents in the final ranking
     """
 
-    rows = []
-    topics = set([])
-    for r in trec_runs:
-        topics = topics.union(r.topics())
+    return _rank_fusion(trec_runs, lambda pos: 1.0 / (k + pos), max_docs, "reciprocal_rank_fusion_k=%d" % k)
 
-    for topic in sorted(topics):
-        doc_scores = {}
-        for r in trec_runs:
-            docs_for_run = r.get_top_documents(topic, n=1000)
 
-            for pos, docid in enumerate(docs_for_run, start=1):
-                doc_scores[docid] = doc_scores.get(docid, 0.0) + 1.0 / (k + pos)
+def rank_biased_precision_fusion(trec_runs, p=0.80, max_docs=1000):
+    """
+        Implements a rank biased precision (RBP) fusion
 
-        # Writes out information for this topic
-        for rank, (docid, score) in enumerate(sorted(iter(doc_scores.items()), key=lambda x: (-x[1], x[0]))[:max_docs], start=1):
-            rows.append((topic, "Q0", docid, rank, score, "reciprocal_rank_fusion_k=%d" % k))
+        Parameters:
+            trec_runs: a list of TrecRun objects to fuse
+            p: persistence parameter of RBP (default = 0.80)
+            max_docs: maximum number of documents in the final ranking
+    """
 
-    # Build a sample run with merged data
-    merged_run = TrecRun(None)
-    df = pd.DataFrame(rows)
-    df.columns = ["query", "q0", "docid", "rank", "score", "system"]
-    merged_run.load_run_from_dataframe(df)
+    return _rank_fusion(trec_runs, lambda pos: (1.0 - p) * (p ** (pos - 1)), max_docs,
+                        "rank_biased_precision_fusion_p=%.3f" % p)
 
-    return merged_run
 
+def fuse_by_topic(topic_streams, fusion_function=reciprocal_rank_fusion, key=None, **kwargs):
+    """
+        Fuses runs given as streams of per topic runs (see trec_run.read_run_by_topic), one topic at a time.
+        Memory is bounded by the largest topic instead of the size of the runs.
 
-def rank_biased_precision_fusion(trec_runs, p=0.80, max_docs=1000):
+        Parameters:
+            topic_streams: a list of streams of per topic runs, all sorted by topic in the same order (see trec_run.align_topics)
+            fusion_function: any fusion function of this module, e.g., combos or reciprocal_rank_fusion
+            key: the order of the topics in the streams. Default: None (the order of TrecRun or the numeric one)
+            kwargs: parameters passed to fusion_function
+
+        Yields one fused TrecRun per topic.
+        Raises ValueError if fusion_function fails for a topic (e.g., combos with an unknown strategy returns None).
     """
-        Implements a rank biased precision (RBP) fusion
+    for topic, runs in align_topics(topic_streams, key=key):
+        fused = fusion_function(runs, **kwargs)
+        if fused is None:
+            raise ValueError("%s failed to fuse topic %s with parameters %s" % (fusion_function.__name__, topic, kwargs))
+        yield fused
+
+
+def fuse_run_files(filenames, output_filename, fusion_function=reciprocal_rank_fusion, chunksize=100000, key=None,
+                   **kwargs):
+    """
+        Fuses run files that are too large to be loaded as TrecRun objects.
+        The files are read in lockstep, one topic at a time (see trec_run.read_run_by_topic), and each fused topic is
+        written to 'output_filename' right away. Memory is bounded by the documents of one topic in all runs.
+
+        Parameters:
+            filenames: a list of run files, all grouped by topic in the same order (see trec_run.align_topics)
+            output_filename: the fused run is written to this file in TREC format
+            fusion_function: any fusion function of this module, e.g., combos or reciprocal_rank_fusion
+            chunksize: number of lines read from each file at a time
+            key: the order of the topics in the files. Default: None (the order of TrecRun or the numeric one)
+            kwargs: parameters passed to fusion_function
+
+        If the fusion fails, the partial output file is removed and the error is raised again.
+    """
+    streams = [read_run_by_topic(filename, chunksize=chunksize) for filename in filenames]
+    try:
+        with open(output_filename, "w") as output:
+            for fused in fuse_by_topic(streams, fusion_function, key=key, **kwargs):
+                fused.run_data[["query", "q0", "docid", "rank", "score", "system"]].to_csv(output, sep=" ", header=False, index=False)
+    except Exception:
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        raise
+
+
+def borda_count(trec_runs, max_docs=1000, depth=1000):
+    """
+        Implements the Borda count fusion of ``Models for Metasearch`` by Aslam and Montague (2001).
+        In each topic, a run gives n - rank + 1 points to the document at 'rank', where n is the number of distinct
+        documents retrieved by all runs. The documents not retrieved by the run share the remaining points equally.
 
         Parameters:
             trec_runs: a list of TrecRun objects to fuse
-            p: persistence parameter of RBP (default = 0.80)
             max_docs: maximum number of documents in the final ranking
+            depth: number of documents of each run and topic that are considered
     """
+    query_codes, query_names, docids, run_ids, positions = _run_positions(trec_runs, depth)
+    pair_codes, documents = _intern_pairs(query_codes, query_names, docids)
 
-    topics = set([])
-    for r in trec_runs:
-        topics = topics.union(r.topics())
+    pair_queries = np.zeros(len(documents), dtype=int)
+    pair_queries[pair_codes] = query_codes
+    ncandidates = np.bincount(pair_queries, minlength=len(query_names))
+    nretrieved = np.bincount(run_ids * len(query_names) + query_codes,
+                             minlength=len(trec_runs) * len(query_names)).reshape(len(trec_runs), len(query_names))
 
-    rows = []
-    for topic in sorted(topics):
-        doc_scores = {}
-        for r in trec_runs:
-            docs_for_run = r.get_top_documents(topic, n=1000)
+    # Points each run gives to every document it did not retrieve: the mean of 1, ..., n - retrieved
+    unranked_points = (ncandidates[None, :] - nretrieved + 1) / 2.
 
-            for pos, docid in enumerate(docs_for_run, start=1):
-                doc_scores[docid] = doc_scores.get(docid, 0.0) + (1.0 - p) * (p ** (pos - 1))
+    # Every document starts with the points for being unranked in all runs, which are corrected by the runs retrieving it
+    points = ncandidates[query_codes] - positions + 1 - unranked_points[run_ids, query_codes]
+    documents["score"] = np.bincount(pair_codes, weights=points, minlength=len(documents)) + \
+        unranked_points.sum(axis=0)[pair_queries]
 
-        # Writes out information for this topic
-        for rank, (docid, score) in enumerate(sorted(iter(doc_scores.items()), key=lambda x: (-x[1], x[0]))[:max_docs],
-                                              start=1):
-            rows.append((topic, "Q0", docid, rank, score, "rank_biased_precision_fusion_p=%.3f" % p))
+    return _ranking_to_run(documents, max_docs, "borda_count")
 
-    # Build a sample run with merged data
-    merged_run = TrecRun(None)
-    df = pd.DataFrame(rows)
-    df.columns = ["query", "q0", "docid", "rank", "score", "system"]
-    merged_run.load_run_from_dataframe(df)
 
-    return merged_run
+def condorcet_fusion(trec_runs, max_docs=1000, depth=1000, n_jobs=1):
+    """
+        Implements a Condorcet fusion (``Condorcet Fusion for Improved Retrieval`` by Montague and Aslam, 2002)
+        through pairwise majority counting. A document beats another if more runs rank it above the other one.
+        Documents not retrieved by a run are ranked below all documents retrieved by it.
+        Documents are ranked by their number of wins minus their number of losses (Copeland score).
+
+        The pairwise counting is quadratic in the number of documents of a topic. Use n_jobs to process topics in
+        parallel processes (None uses all CPUs).
+
+        Parameters:
+            trec_runs: a list of TrecRun objects to fuse
+            max_docs: maximum number of documents in the final ranking
+            depth: number of documents of each run and topic that are considered
+            n_jobs: number of processes. Default = 1 (no extra processes)
+    """
+    query_codes, query_names, docids, run_ids, positions = _run_positions(trec_runs, depth)
+    pair_codes, documents = _intern_pairs(query_codes, query_names, docids)
+
+    pair_queries = np.zeros(len(documents), dtype=int)
+    pair_queries[pair_codes] = query_codes
 
+    # A (documents x runs) rank matrix with the documents grouped by topic, inf where the run did not retrieve the document
+    pairs_by_query = np.argsort(pair_queries, kind="stable")
+    rows = np.empty(len(documents), dtype=int)
+    rows[pairs_by_query] = np.arange(len(documents))
+    ranks = np.full((len(documents), len(trec_runs)), np.inf)
+    ranks[rows[pair_codes], run_ids] = positions
 
-def borda_count(trec_runs):
-    print("TODO: BordaCount (Aslam & Montague, 2001)")
+    # One block of rows per topic
+    starts = np.searchsorted(pair_queries[pairs_by_query], np.arange(1, len(query_names)))
+    rank_matrices = np.split(ranks, starts)
+
+    if n_jobs == 1:
+        topic_scores = list(map(_condorcet_scores, rank_matrices))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            topic_scores = list(executor.map(_condorcet_scores, rank_matrices))
+
+    scores = np.empty(len(documents))
+    scores[pairs_by_query] = np.concatenate(topic_scores) if len(topic_scores) > 0 else []
+    documents["score"] = scores
+
+    return _ranking_to_run(documents, max_docs, "condorcet_fusion")
+
+
+def _condorcet_scores(ranks):
+    """
+        Returns the Copeland score of each row of a (documents x runs) rank matrix.
+    """
+    wins = np.zeros((ranks.shape[0], ranks.shape[0]), dtype=np.int32)
+    for run in range(ranks.shape[1]):
+        wins += ranks[:, run][:, None] < ranks[:, run][None, :]
+    return np.sign(wins - wins.T).sum(axis=1).astype(float)
 
 
 def svp(trec_runs):
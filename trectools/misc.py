@@ -46,10 +46,29 @@ def check_fleish_kappa(tuple_of_judgements):
     return kappa
 
 
-def unique_documents(list_of_runs, cutoff=10):
-    # TODO: this should return a <RUN, [documents] >, in which for each RUN, we have a list
-    # of documents that were uniquely provided by this RUN
-    pass
+def unique_documents(list_of_runs, cutoff=10, groups=None):
+    """
+        Returns a dict {runid: TrecPool} with the documents that only this run has among the top 'cutoff' documents
+        of each topic, i.e., the documents that a topX pool of all runs would lose without this run.
+        groups: optional list with the group (e.g., the team) of each run. The documents are then unique to a group,
+        and the dict is {group: TrecPool}. Without groups, runs with the same runid are taken as one group.
+    """
+    if groups is None:
+        groups = [r.get_runid() for r in list_of_runs]
+    if len(groups) != len(list_of_runs):
+        raise ValueError("Expected one group per run, got %d groups for %d runs" % (len(groups), len(list_of_runs)))
+    if len(list_of_runs) == 0:
+        return {}
+
+    group_codes, labels = pd.factorize(pd.Series(groups, dtype=object))
+    top = pd.concat([r.run_data.groupby("query", sort=False, observed=True).head(cutoff)[["query", "docid"]].assign(group=g)
+                     for g, r in zip(group_codes, list_of_runs)]).drop_duplicates()
+    n_groups = top.groupby(["query", "docid"], observed=True)["group"].transform("size").values
+    unique = top[n_groups == 1]
+
+    documents = dict((labels[g], docs.groupby("query", observed=True)["docid"].agg(set).to_dict())
+                     for g, docs in unique.groupby("group"))
+    return dict((label, TrecPool(documents.get(label, {}))) for label in labels)
 
 
 def sort_systems_by(list_trec_res, metric="map"):
@@ -4,7 +4,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from glob import glob
-from trectools import TrecRun
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from trectools import TrecRes, TrecRun, TrecPool, TrecQrel, TrecEval, TrecQrelIndex, TrecRelevanceMatrix
 from trectools import misc
 import os
 
@@ -52,6 +54,11 @@ def plot_distribuition():
 
 
 def list_of_runs_from_path(path, suffix="*"):
+    """
+        Loads all runs in 'path' whose file names match 'suffix'.
+        To parse and evaluate many runs in parallel, use evaluate_runs_from_path, whose worker processes only send
+        back the results instead of the parsed runs.
+    """
     runs = []
     for r in glob(os.path.join(path, suffix)):
         tr = TrecRun(r)
@@ -61,13 +68,153 @@ def list_of_runs_from_path(path, suffix="*"):
     return runs
 
 
-def evaluate_runs(trec_runs, trec_qrel, per_query):
+# The qrels of the worker processes used by evaluate_runs and evaluate_runs_from_path.
+# They are shipped once to each worker by _init_evaluation_worker instead of being pickled with every run.
+_worker_qrels = None
+_worker_qrels_index = None
+
+
+def _init_evaluation_worker(trec_qrel, engine):
+    global _worker_qrels, _worker_qrels_index
+    _worker_qrels = trec_qrel
+    _worker_qrels_index = TrecQrelIndex(trec_qrel) if engine == "single_pass" else None
+
+
+def _evaluate_run_in_worker(run, per_query, engine):
+    if not isinstance(run, TrecRun):
+        run = TrecRun(run)
+    return run.evaluate_run(_worker_qrels, per_query, engine=engine, qrels_index=_worker_qrels_index)
+
+
+def _evaluate_runs_in_pool(runs, trec_qrel, per_query, n_jobs, engine):
+    n = len(runs)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_evaluation_worker,
+                             initargs=(trec_qrel, engine)) as executor:
+        # map returns the results in the same order as the runs
+        return list(executor.map(_evaluate_run_in_worker, runs, [per_query] * n, [engine] * n))
+
+
+def evaluate_runs(trec_runs, trec_qrel, per_query, n_jobs=1, engine="pandas"):
+    """
+        Evaluates each run with TrecEval.evaluate_all and returns a list of TrecRes, in the same order as trec_runs.
+        n_jobs: number of processes used for the evaluation. None uses all cores. Default = 1
+        engine: the engine of TrecEval.evaluate_all. Default = "pandas"
+    """
+    if n_jobs != 1:
+        return _evaluate_runs_in_pool(list(trec_runs), trec_qrel, per_query, n_jobs, engine)
+
     results = []
     for r in trec_runs:
-        results.append(r.evaluate_run(trec_qrel, per_query))
+        results.append(r.evaluate_run(trec_qrel, per_query, engine=engine))
     return results
 
 
+def evaluate_runs_from_path(path, trec_qrel, suffix="*", per_query=False, n_jobs=1, engine="single_pass"):
+    """
+        Parses and evaluates all runs in 'path' whose file names match 'suffix'.
+        Each worker process reads its runs from disk, so only file names and results travel between processes.
+
+        n_jobs: number of processes. None uses all cores. Default = 1
+        engine: the engine of TrecEval.evaluate_all. Default = "single_pass"
+
+        Returns a list of TrecRes sorted by file name.
+    """
+    filenames = sorted(glob(os.path.join(path, suffix)))
+    print("Found %s runs in path %s" % (len(filenames), path))
+    if n_jobs != 1:
+        return _evaluate_runs_in_pool(filenames, trec_qrel, per_query, n_jobs, engine)
+
+    qrels_index = TrecQrelIndex(trec_qrel) if engine == "single_pass" else None
+    return [TrecRun(filename).evaluate_run(trec_qrel, per_query, engine=engine, qrels_index=qrels_index)
+            for filename in filenames]
+
+
+def evaluate_runs_batch(trec_runs, trec_qrel, per_query=False):
+    """
+        Evaluates many runs against the same qrels. The qrels are preprocessed only once (see TrecQrelIndex) and
+        each run is evaluated with TrecEval.evaluate_all(engine="single_pass").
+        trec_runs can be any iterable of TrecRun objects, e.g., a generator that loads one run at a time.
+
+        Returns a pandas dataframe with cols (runid, metric, query, value) with the results of all runs.
+    """
+    qrels_index = TrecQrelIndex(trec_qrel)
+
+    results = []
+    for r in trec_runs:
+        res = TrecEval(r, trec_qrel, qrels_index=qrels_index).evaluate_all(per_query=per_query, engine="single_pass")
+        # The runid goes to its own col, so that all values are numeric
+        data = res.data[res.data["metric"] != "runid"]
+        results.append(pd.DataFrame({"runid": res.get_runid(), "metric": data["metric"].values,
+                                     "query": data["query"].values, "value": data["value"].values.astype(float)}))
+
+    if len(results) == 0:
+        return pd.DataFrame(columns=["runid", "metric", "query", "value"])
+    return pd.concat(results, ignore_index=True)
+
+
+def evaluate_run_by_topic(topic_runs, trec_qrel, per_query=False):
+    """
+        Evaluates a run given as a stream of per topic runs, e.g., trec_run.read_run_by_topic(filename),
+        so that only one topic of the run is in memory at a time.
+        Each topic is evaluated with TrecEval.evaluate_all(engine="single_pass") and the summary is
+        computed as evaluate_all does it for the complete run. Per query results are only reported
+        for the topics in the run.
+
+        Returns a TrecRes object.
+    """
+    qrels_index = TrecQrelIndex(trec_qrel)
+
+    run_id = None
+    gmean_min = None
+    topic_summaries = []
+    maps = {}
+    results_per_query = []
+    for run in topic_runs:
+        topic = run.run_data["query"].iloc[0]
+        evaluator = TrecEval(run, trec_qrel, qrels_index=qrels_index)
+        data = evaluator.evaluate_all(per_query=per_query, engine="single_pass").data
+        if run_id is None:
+            run_id = run.get_runid()
+            gmean_min = evaluator.GMEAN_MIN
+
+        # For a single topic, the summary holds the value of the topic (or the sum over its documents)
+        summary = data[(data["query"] == "all") & (data["metric"] != "runid")].set_index("metric")["value"]
+        topic_summaries.append(summary.astype(float))
+        maps[topic] = summary["map"]
+        if per_query:
+            results_per_query.append(data[data["query"] == topic])
+
+    if run_id is None:
+        raise ValueError("Cannot evaluate a run without topics.")
+
+    # Sums are kept, averages are taken over all topics of the run
+    nqueries = len(topic_summaries)
+    summary = pd.concat(topic_summaries, axis=1).sum(axis=1) / nqueries
+    for metric in ["num_ret", "num_rel_ret"]:
+        summary[metric] = summary[metric] * nqueries
+    summary["num_rel"] = qrels_index.relevant_per_query.sum()
+    summary["num_q"] = nqueries
+
+    # Queries with relevant documents that are not in the run count as NaN, as in TrecEval.get_map
+    maps = pd.Series(maps)
+    relevant = qrels_index.relevant_per_query
+    maps = maps.reindex(maps.index.union(relevant[relevant > 0].index.difference(maps.index)))
+    from scipy.stats.mstats import gmean
+    summary["gm_map"] = gmean(maps.replace(0.0, gmean_min))
+
+    rows = [{"metric": "runid", "query": "all", "value": run_id}]
+    for metric, value in summary.items():
+        rows.append({"metric": metric, "query": "all", "value": value})
+    rows = pd.DataFrame(rows)
+    if per_query:
+        rows = pd.concat(results_per_query + [rows], sort=True).reset_index(drop=True)
+
+    res = TrecRes()
+    res.data = rows
+    res.runid = run_id
+    return res
+
+
 def evaluate_runs_ubire(trec_runs, trec_qrel, trec_qread, extension):
     results = []
     for r in trec_runs:
@@ -87,12 +234,87 @@ def extract_metric_from_results(trec_ress, metric):
     return results
 
 
+def _get_judged_documents(judgements):
+    """
+        Returns a dataframe with cols (query, docid) with the documents of a TrecPool or a TrecQrel.
+    """
+    if isinstance(judgements, TrecPool):
+        pool = judgements.pool
+        queries = np.repeat(np.array([str(q) for q in pool.keys()], dtype=object), [len(d) for d in pool.values()])
+        return pd.DataFrame({"query": queries, "docid": list(chain.from_iterable(pool.values()))}, dtype=str)
+    return judgements.qrels_data[["query", "docid"]].astype(str)
+
+
+def get_coverage_matrix(trec_runs, judgements, cutoffs=(10,), unjudged=True):
+    """
+        Counts how many of the top k documents of each topic of each run are judged, for all k in cutoffs.
+        The top documents of all runs are checked against the judged documents with a single merge.
+
+        judgements: a TrecPool or a TrecQrel
+        unjudged: also counts the top k documents that are not judged
+
+        Returns a pandas dataframe indexed by runid, with cols (metric, query) where metric is 'judged@k' or
+        'unjudged@k'. E.g., result["judged@10"] is the runs x topics matrix of judged@10.
+        Topics that a run did not retrieve are NaN.
+    """
+    cutoffs = np.unique(cutoffs)
+    if len(cutoffs) == 0 or cutoffs[0] < 1:
+        raise ValueError("cutoffs must be a non-empty list of positive integers, got %s" % (str(list(cutoffs))))
+    depth = cutoffs[-1]
+
+    runids = []
+    tops = []
+    for r in trec_runs:
+        # Position of each document in its topic, in the order of get_top_documents
+        positions = r.run_data.groupby("query", sort=False, observed=True).cumcount().values
+        top = r.run_data[positions < depth]
+        tops.append(pd.DataFrame({"run": len(runids), "query": top["query"].astype(str).values,
+                                  "docid": top["docid"].astype(str).values, "position": positions[positions < depth]}))
+        runids.append(r.get_runid())
+
+    if len(runids) == 0:
+        return pd.DataFrame()
+
+    judged = _get_judged_documents(judgements).drop_duplicates()
+    judged["judged"] = 1.0
+    top = pd.concat(tops, ignore_index=True).merge(judged, on=["query", "docid"], how="left")
+
+    # A document at position p is among the top k of all cutoffs k > p
+    topic_rows, topics = pd.factorize(top["query"], sort=True)
+    first_cutoff = np.searchsorted(cutoffs, top["position"].values, side="right")
+    cells = (top["run"].values * len(topics) + topic_rows) * len(cutoffs) + first_cutoff
+    shape = (len(runids), len(topics), len(cutoffs))
+    n_judged = np.bincount(cells, weights=top["judged"].fillna(0.0).values, minlength=np.prod(shape))
+    n_judged = np.cumsum(n_judged.reshape(shape), axis=2)
+    n_retrieved = np.cumsum(np.bincount(cells, minlength=np.prod(shape)).reshape(shape), axis=2).astype(float)
+    n_unjudged = n_retrieved - n_judged
+
+    not_retrieved = n_retrieved[:, :, -1] == 0
+    n_judged[not_retrieved] = np.nan
+    n_unjudged[not_retrieved] = np.nan
+
+    matrices = {}
+    for i, k in enumerate(cutoffs):
+        matrices["judged@%d" % k] = pd.DataFrame(n_judged[:, :, i], index=runids, columns=topics)
+        if unjudged:
+            matrices["unjudged@%d" % k] = pd.DataFrame(n_unjudged[:, :, i], index=runids, columns=topics)
+
+    result = pd.concat(matrices, axis=1, names=["metric", "query"])
+    result.index.name = "runid"
+    return result
+
+
 def get_pool_coverage(trec_runs, trec_qrels, topX=10):
+    """
+        Returns a list of (runid, mean, ci) with the mean number of judged documents among the topX documents of
+        the topics of each run and its 95% confidence interval.
+        trec_qrels can also be a TrecPool.
+    """
+    coverage = get_coverage_matrix(trec_runs, trec_qrels, cutoffs=[topX], unjudged=False)
+
     results = []
-    for r in trec_runs:
-        # n = r.get_runid()
-        n = r.run_data.get_value(0,"system") # TODO: Replace by at or iat
-        covs = r.check_qrel_coverage(trec_qrels, topX=topX)
+    for n, covs in coverage.iterrows():
+        covs = covs.dropna().values
 
         m = np.mean(covs)
         ci = misc.confidence_interval(covs, confidence=0.95)
@@ -100,3 +322,81 @@ def get_pool_coverage(trec_runs, trec_qrels, topX=10):
         results.append((n,m,ci))
 
     return results
+
+
+def _summarize_matrix(matrix, run_order, metrics):
+    """
+        Returns {metric: value} for the metrics of evaluate_all that can be computed from a TrecRelevanceMatrix
+        (map, P_k, NDCG_k, Rprec, recip_rank and bpref), averaged as in evaluate_all. As in evaluate_all, NDCG uses
+        the matrix in the order of the run ('run_order') and all other metrics the matrix sorted as trec_eval does.
+    """
+    nqueries = len(matrix.queries)
+    summary = {}
+    for metric in metrics:
+        name, _, depth = metric.partition("_")
+        if metric == "map":
+            values = matrix.get_map(depth=10000)
+        elif metric == "Rprec":
+            values = matrix.get_rprec(depth=1000)
+        elif metric == "recip_rank":
+            values = matrix.get_reciprocal_rank(depth=1000)
+        elif metric == "bpref":
+            values = matrix.get_bpref(depth=1000)
+        elif name == "P" and depth.isdigit():
+            values = matrix.get_precision(depth=int(depth))
+        elif name == "NDCG" and depth.isdigit():
+            values = run_order.get_ndcg(depth=int(depth), trec_eval=True)
+        else:
+            raise ValueError("Metric '%s' is not supported. Options are map, P_k, NDCG_k, Rprec, recip_rank and bpref" % (metric))
+        summary[metric] = values.sum() / nqueries if nqueries > 0 else 0.0
+    return summary
+
+
+def leave_one_out_evaluation(trec_runs, trec_qrel, cutoff=10, groups=None, metrics=("map", "P_10", "bpref")):
+    """
+        Leave-one-run-out (or leave-one-group-out) test of the reusability of a qrel made from a topX pool of the runs.
+        For each run, the judgements of the documents that only its group contributed to the pool at depth 'cutoff'
+        (see misc.unique_documents) are removed from the qrels, and the run is evaluated again with the reduced qrels.
+
+        The run is merged with the qrels only once (see TrecRelevanceMatrix.remove_judgements), instead of pooling
+        and evaluating all runs again for each group that is left out.
+
+        groups: optional list with the group (e.g., the team) of each run. All runs of a group are left out together.
+        metrics: metrics of evaluate_all, among map, P_k, NDCG_k, Rprec, recip_rank and bpref.
+                 Default: ("map", "P_10", "bpref")
+
+        Returns a pandas dataframe with cols (runid, group, metric, value, leave_out_value), where value is obtained with
+        the full qrels and leave_out_value with the reduced ones, and a col 'unique' with the number of judgements removed.
+    """
+    trec_runs = list(trec_runs)
+    if groups is None:
+        groups = [r.get_runid() for r in trec_runs]
+    unique = misc.unique_documents(trec_runs, cutoff=cutoff, groups=groups)
+
+    qrels_data = trec_qrel.qrels_data
+    qrels_index = TrecQrelIndex(trec_qrel)
+    reduced = {}
+
+    rows = []
+    for r, group in zip(trec_runs, groups):
+        if group not in reduced:
+            # Judgements of the documents that only this group contributed
+            judgements = qrels_data[["query", "docid"]].astype(str)
+            unique_documents = _get_judged_documents(unique[group]).assign(left_out=True)
+            left_out = judgements.merge(unique_documents, how="left")["left_out"].notna().values
+            removed = judgements[left_out].drop_duplicates()
+            reduced_qrel = TrecQrel()
+            reduced_qrel.qrels_data = qrels_data[~left_out]
+            reduced[group] = (removed, TrecQrelIndex(reduced_qrel))
+        removed, reduced_index = reduced[group]
+
+        run_order = TrecRelevanceMatrix(r, qrels_index, trec_eval=False)
+        matrix = run_order.sort_by_score()
+        values = _summarize_matrix(matrix, run_order, metrics)
+        queries, docids = removed["query"].values, removed["docid"].values
+        leave_out_values = _summarize_matrix(matrix.remove_judgements(reduced_index, queries, docids),
+                                             run_order.remove_judgements(reduced_index, queries, docids), metrics)
+        for metric in metrics:
+            rows.append((r.get_runid(), group, metric, values[metric], leave_out_values[metric], len(removed)))
+
+    return pd.DataFrame(rows, columns=["runid", "group", "metric", "value", "leave_out_value", "unique"])
@@ -0,0 +1,138 @@
+import heapq
+
+import pandas as pd
+
+from trectools import TrecPool, TrecQrel
+
+
+class TrecAdaptivePool:
+
+    def __init__(self, list_of_runs, strategy="mtf", depth=None):
+        """
+            Builds a pool one document at a time, choosing the next document to judge from the judgements made so far.
+            Each topic keeps a cursor over the ranked list of each run and a priority heap of runs, so that
+            next_document and record_judgment take O(log n) time for n runs (plus skipping documents already judged).
+
+            Params
+            -------
+            list_of_runs: list of TrecRun objects
+            strategy: how the next run to take a document from is chosen. Default: "mtf"
+                * mtf: Move-to-front (Cormack et al., Efficient construction of large test collections, SIGIR 1998).
+                  A run keeps its priority while it finds relevant documents and loses one for each non-relevant one.
+                * bandit: Multi-armed bandit where each run is an arm (Losada et al., Feeling lucky? Multi-armed
+                  bandits for ordering judgements in pooling-based evaluation, SAC 2016). The run with the highest
+                  posterior mean of its rate of relevant documents, (relevant + 1) / (judged + 2), is chosen.
+            depth: only the top 'depth' documents of each run are pooled. Default: None (all documents)
+
+            Documents are credited to the run that proposed them. Documents retrieved by other runs are skipped
+            by them once judged.
+        """
+        if strategy not in ["mtf", "bandit"]:
+            raise ValueError("Strategy '%s' does not exist. Options are 'mtf' and 'bandit'" % (strategy))
+
+        self.runs = list_of_runs
+        self.strategy = strategy
+        self.depth = depth
+        self.judgements = {}
+        self.__topics = {}
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "Adaptive pool (%s) of %d runs with %d judged documents." % (self.strategy, len(self.runs),
+                                                                            sum(len(j) for j in self.judgements.values()))
+
+    def __get_topic(self, topic):
+        """
+            Returns the state of 'topic', creating it on first use.
+        """
+        if topic not in self.__topics:
+            state = {
+                "documents": [run.get_top_documents(topic, n=self.depth) for run in self.runs],
+                "cursors": [0] * len(self.runs),
+                "relevant": [0] * len(self.runs),
+                "judged": [0] * len(self.runs),
+                "proposed": {},
+                "versions": [0] * len(self.runs),
+                "heap": [],
+                "counter": 0,
+            }
+            self.__topics[topic] = state
+            self.judgements.setdefault(topic, {})
+            for i in range(len(self.runs)):
+                self.__push(state, i)
+        return self.__topics[topic]
+
+    def __priority(self, state, i):
+        if self.strategy == "mtf":
+            return -(state["judged"][i] - state["relevant"][i])
+        return (state["relevant"][i] + 1.0) / (state["judged"][i] + 2.0)
+
+    def __push(self, state, i):
+        """
+            Pushes run 'i' with its current priority. Entries of older versions of the run are dropped when they reach
+            the top of the heap. The counter breaks ties in favour of the run that got its priority first.
+        """
+        state["versions"][i] += 1
+        state["counter"] += 1
+        heapq.heappush(state["heap"], (-self.__priority(state, i), state["counter"], i, state["versions"][i]))
+
+    def next_document(self, topic):
+        """
+            Returns the next document to judge for 'topic', or None if all documents of all runs were proposed.
+            Documents proposed but not judged yet are not proposed again.
+        """
+        state = self.__get_topic(topic)
+        judged, proposed, heap = self.judgements[topic], state["proposed"], state["heap"]
+        while heap:
+            _, _, i, version = heap[0]
+            if version != state["versions"][i]:
+                heapq.heappop(heap)
+                continue
+
+            documents, cursor = state["documents"][i], state["cursors"][i]
+            while cursor < len(documents) and (documents[cursor] in judged or documents[cursor] in proposed):
+                cursor += 1
+            state["cursors"][i] = cursor
+            if cursor == len(documents):
+                # This run has nothing else to propose
+                heapq.heappop(heap)
+                continue
+
+            state["cursors"][i] = cursor + 1
+            proposed[documents[cursor]] = i
+            return documents[cursor]
+        return None
+
+    def record_judgment(self, topic, docid, rel):
+        """
+            Records the relevance label of a document. If the document was proposed by next_document, the run that
+            proposed it is updated.
+        """
+        state = self.__get_topic(topic)
+        self.judgements[topic][docid] = rel
+        i = state["proposed"].pop(docid, None)
+        if i is not None:
+            priority = self.__priority(state, i)
+            state["judged"][i] += 1
+            if rel > 0:
+                state["relevant"][i] += 1
+            # A run that keeps its priority also keeps its place (e.g., move-to-front after a relevant document)
+            if self.__priority(state, i) != priority:
+                self.__push(state, i)
+
+    def get_pool(self):
+        """
+            Returns a TrecPool with the documents judged so far.
+        """
+        return TrecPool(dict((topic, set(judged.keys())) for topic, judged in self.judgements.items() if judged))
+
+    def get_qrels(self):
+        """
+            Returns a TrecQrel with the judgements recorded so far.
+        """
+        rows = [(topic, 0, docid, rel) for topic, judged in self.judgements.items() for docid, rel in judged.items()]
+        qrels = TrecQrel()
+        qrels.qrels_data = pd.DataFrame(rows, columns=["query", "q0", "docid", "rel"])
+        return qrels
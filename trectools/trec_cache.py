@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Standard libraries
+import json
+import logging
+import os
+
+# External libraries
+import numpy as np
+import pandas as pd
+
+'''
+Binary sidecar cache for parsed runs and qrels.
+
+The columns of the parsed DataFrame are stored as NumPy arrays in an .npz file next to the text
+file (or into a cache directory), together with the size and modification time of the source file
+and the options used to parse it. A later load only uses the sidecar if all of them still match,
+otherwise the file is parsed again and the sidecar is rewritten.
+
+Sidecars are read with allow_pickle=False: they only hold plain arrays (identifiers as fixed-width
+unicode strings), so a sidecar written by someone else cannot run code when it is loaded.
+'''
+
+SIDECAR_SUFFIX = ".trectools.npz"
+
+
+def get_sidecar_filename(filename, cache=True):
+    """
+        Returns the sidecar file used for 'filename'.
+        'cache' is either True (sidecar next to the source file) or the directory holding the sidecars.
+    """
+    fullpath = os.path.abspath(os.path.expanduser(filename))
+    if cache is True:
+        return fullpath + SIDECAR_SUFFIX
+    # Files with the same name in different directories must not share a sidecar
+    flat_name = fullpath.strip(os.sep).replace(os.sep, "__")
+    return os.path.join(os.path.expanduser(cache), flat_name + SIDECAR_SUFFIX)
+
+
+def _get_signature(filename, options):
+    stat = os.stat(filename)
+    return {"path": os.path.abspath(os.path.expanduser(filename)), "size": stat.st_size,
+            "mtime": stat.st_mtime_ns, "options": repr(options)}
+
+
+def _to_arrays(df):
+    """
+        Splits 'df' into plain arrays: {name: array} and the list of (column, kind) needed to rebuild it.
+        Returns None if a column cannot be stored without pickling (e.g., mixed Python objects).
+    """
+    arrays = {"index": np.asarray(df.index)}
+    if arrays["index"].dtype.kind not in "iu":
+        return None
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = np.asarray(values.cat.categories)
+            if pd.api.types.infer_dtype(categories, skipna=False) != "string":
+                return None
+            arrays["codes_%d" % (i)] = values.cat.codes.values
+            arrays["categories_%d" % (i)] = categories.astype(str)
+            columns.append((column, "category"))
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            arrays["values_%d" % (i)] = values.values
+            columns.append((column, "numeric"))
+        elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=False) == "string":
+            arrays["values_%d" % (i)] = values.values.astype(str)
+            columns.append((column, "str"))
+        else:
+            return None
+    return arrays, columns
+
+
+def _from_arrays(content, columns):
+    data = {}
+    for i, (column, kind) in enumerate(columns):
+        if kind == "category":
+            data[column] = pd.Categorical.from_codes(content["codes_%d" % (i)], content["categories_%d" % (i)])
+        elif kind == "str":
+            data[column] = content["values_%d" % (i)].astype(object)
+        else:
+            data[column] = content["values_%d" % (i)]
+    return pd.DataFrame(data, index=content["index"], columns=[column for column, kind in columns])
+
+
+def load_cached_frame(filename, options, cache=True):
+    """
+        Returns the DataFrame stored for 'filename' parsed with 'options', or None if there is no
+        sidecar or if it is stale.
+    """
+    sidecar = get_sidecar_filename(filename, cache)
+    if not os.path.isfile(sidecar):
+        return None
+    try:
+        with np.load(sidecar, allow_pickle=False) as content:
+            header = json.loads(str(content["header"]))
+            if header["signature"] != _get_signature(filename, options):
+                return None
+            return _from_arrays(content, header["columns"])
+    except Exception as e:
+        logging.warning("Could not read cache file %s: %s" % (sidecar, e))
+        return None
+
+
+def store_cached_frame(filename, options, df, cache=True):
+    """
+        Writes 'df', the result of parsing 'filename' with 'options', to its sidecar.
+        Failing to write the sidecar (e.g., read-only directory) is not an error.
+    """
+    sidecar = get_sidecar_filename(filename, cache)
+    converted = _to_arrays(df)
+    if converted is None:
+        logging.warning("Could not write cache file %s: the data has columns that are not strings or numbers" % (sidecar))
+        return
+    arrays, columns = converted
+    header = json.dumps({"signature": _get_signature(filename, options), "columns": columns})
+
+    tmpfile = "%s.%d.tmp" % (sidecar, os.getpid())
+    try:
+        if cache is not True:
+            os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        # Writing to an open file keeps np.savez from adding its own extension
+        with open(tmpfile, "wb") as f:
+            np.savez(f, header=np.array(header), **arrays)
+        os.replace(tmpfile, sidecar)
+    except OSError as e:
+        logging.warning("Could not write cache file %s: %s" % (sidecar, e))
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
@@ -1,4 +1,4 @@
-from trectools import TrecRes, TrecRun, TrecQrel
+from trectools import TrecRes, TrecRun, TrecQrel, TrecQrelIndex, TrecRelevanceMatrix
 from scipy.stats import norm
 import pandas as pd
 import numpy as np
@@ -6,7 +6,7 @@ import numpy as np
 
 class TrecEval:
 
-    def __init__(self, run, qrels):
+    def __init__(self, run, qrels, qrels_index=None):
         """
             TrecEval performs the retrieval system evaluation.
 
@@ -14,6 +14,8 @@ class TrecEval:
             -------
             run: an object of type TrecRun
             qrels: an object of type TrecQrel
+            qrels_index: an optional TrecQrelIndex built from 'qrels'. Share it among the TrecEval objects of many runs
+                         to avoid preprocessing the same qrels again for every run (see procedures.evaluate_runs_batch).
 
             Returns
             --------
@@ -26,27 +28,45 @@ class TrecEval:
         if not isinstance(qrels, TrecQrel):
             raise TypeError('"qrels" should be a TrecQrel object')
 
+        if qrels_index is not None and not isinstance(qrels_index, TrecQrelIndex):
+            raise TypeError('"qrels_index" should be a TrecQrelIndex object')
+
         self.run = run
         self.qrels = qrels
+        self.qrels_index = qrels_index
 
         self.GMEAN_MIN = .00001 # To have the same behavior as trec_eval
 
+        # Cache of TrecRelevanceMatrix objects, see get_relevance_matrix
+        self.relevance_matrices = {}
+        self.__matrices_data = (None, None)
+        self.__values_per_query = None
+        self.__qrels_index_data = qrels.qrels_data
+
     def get_runid(self):
         return self.run.get_filename()
 
-    def evaluate_all(self, per_query=False):
+    def evaluate_all(self, per_query=False, engine="pandas"):
         """
             Runs all evaluation metrics as the default trec_eval tool.
 
             Params
             -------
             per_query: If True, runs the evaluation per query. Default = False
+            engine: "pandas" runs each metric independently through its get_* method.
+                    "single_pass" sorts and joins the run with the qrels only once and derives every metric from
+                    this shared ranking. Both engines return the same results. Default = "pandas"
 
             Returns
             --------
             An TrecRes object
 
         """
+        if engine == "single_pass":
+            return self.__evaluate_all_single_pass(per_query)
+        elif engine != "pandas":
+            raise ValueError('Unknown engine "%s". Options are "pandas" and "single_pass".' % (engine))
+
         run_id = self.run.get_runid()
         results_per_query = []
 
@@ -109,36 +129,37 @@ class TrecEval:
         rprec_ = self.get_rprec(depth=1000, per_query=False, trec_eval=True)
         recip_rank_ = self.get_reciprocal_rank(depth=1000, per_query=False, trec_eval=True)
 
-        rows = [
-            {"metric": "runid", "query": "all", "value": run_id},
-            {"metric": "num_ret", "query": "all", "value": self.get_retrieved_documents(per_query=False)},
-            {"metric": "num_rel", "query": "all", "value": self.get_relevant_documents(per_query=False)},
-            {"metric": "num_rel_ret", "query": "all", "value": self.get_relevant_retrieved_documents(per_query=False)},
-            {"metric": "num_q", "query": "all", "value": len(self.run.topics())},
-            {"metric": "map", "query": "all", "value": map_},
-            {"metric": "gm_map", "query": "all", "value": gm_map_},
-            {"metric": "bpref", "query": "all", "value": bpref_},
-            {"metric": "Rprec", "query": "all", "value": rprec_},
-            {"metric": "recip_rank", "query": "all", "value": recip_rank_},
-            {"metric": "P_5", "query": "all", "value": ps[5]},
-            {"metric": "P_10", "query": "all", "value": ps[10]},
-            {"metric": "P_15", "query": "all", "value": ps[15]},
-            {"metric": "P_20", "query": "all", "value": ps[20]},
-            {"metric": "P_30", "query": "all", "value": ps[30]},
-            {"metric": "P_100", "query": "all", "value": ps[100]},
-            {"metric": "P_200", "query": "all", "value": ps[200]},
-            {"metric": "P_500", "query": "all", "value": ps[500]},
-            {"metric": "P_1000", "query": "all", "value": ps[1000]},
-            {"metric": "NDCG_5", "query": "all", "value": ndcg[5]},
-            {"metric": "NDCG_10", "query": "all", "value": ndcg[10]},
-            {"metric": "NDCG_15", "query": "all", "value": ndcg[15]},
-            {"metric": "NDCG_20", "query": "all", "value": ndcg[20]},
-            {"metric": "NDCG_30", "query": "all", "value": ndcg[30]},
-            {"metric": "NDCG_100", "query": "all", "value": ndcg[100]},
-            {"metric": "NDCG_200", "query": "all", "value": ndcg[200]},
-            {"metric": "NDCG_500", "query": "all", "value": ndcg[500]},
-            {"metric": "NDCG_1000", "query": "all", "value": ndcg[1000]},
-        ]
+        summary = {
+            "num_ret": self.get_retrieved_documents(per_query=False),
+            "num_rel": self.get_relevant_documents(per_query=False),
+            "num_rel_ret": self.get_relevant_retrieved_documents(per_query=False),
+            "num_q": len(self.run.topics()),
+            "map": map_,
+            "gm_map": gm_map_,
+            "bpref": bpref_,
+            "Rprec": rprec_,
+            "recip_rank": recip_rank_,
+        }
+        for v in [5, 10, 15, 20, 30, 100, 200, 500, 1000]:
+            summary["P_%d" % (v)] = ps[v]
+        for v in [5, 10, 15, 20, 30, 100, 200, 500, 1000]:
+            summary["NDCG_%d" % (v)] = ndcg[v]
+
+        return self.__make_res(run_id, summary, results_per_query)
+
+    def __make_res(self, run_id, summary, results_per_query):
+        """
+            Builds the TrecRes returned by evaluate_all.
+
+            Params
+            -------
+            run_id: the name of the evaluated run
+            summary: a dict {metric: value} with the values over all queries
+            results_per_query: a list of pandas dataframes with cols (query, value, metric). Might be empty.
+        """
+        rows = [{"metric": "runid", "query": "all", "value": run_id}]
+        for metric, value in summary.items():
+            rows.append({"metric": metric, "query": "all", "value": value})
 
         # TODO: iprec_at_recall_LEVEL is missing from the default trec_eval metrics
 
@@ -153,6 +174,192 @@ class TrecEval:
 
         return res
 
+    def __evaluate_all_single_pass(self, per_query=False):
+        """
+            Same as evaluate_all, but the run is sorted and merged with the qrels only once.
+            Every metric is then a reduction over the TrecRelevanceMatrix of this run.
+            The values per query are kept, so that update_judgements only computes again the queries that changed.
+        """
+        run_id = self.run.get_runid()
+
+        values = self.__get_values_per_query()
+        matrix = self.get_relevance_matrix(trec_eval=True)
+
+        # check number of queries
+        nqueries = len(matrix.queries)
+        num_rel = matrix.relevant_per_query
+
+        cutoffs = [5, 10, 15, 20, 30, 100, 200, 500, 1000]
+        ps = values[["P@%d" % (v) for v in cutoffs]]
+        ndcgs = self.__add_qrels_only_queries(values[["NDCG@%d" % (v) for v in cutoffs]], matrix)
+        map_ = self.__add_qrels_only_queries(values["MAP@10000"], matrix)
+        bpref = values["Bpref@1000"].dropna()
+        rprec = values["RPrec@1000"].reindex(num_rel.index)
+        recip_rank = values["recip_rank@1000"]
+        num_ret = values["num_ret"]
+        num_rel_ret = values["num_rel_ret"]
+        num_rel_ret = num_rel_ret[num_rel_ret > 0]
+
+        from scipy.stats.mstats import gmean
+        summary = {
+            "num_ret": num_ret.sum(),
+            "num_rel": num_rel.sum(),
+            "num_rel_ret": num_rel_ret.sum(),
+            "num_q": nqueries,
+            "map": map_.sum() / nqueries,
+            "gm_map": gmean(map_.replace(0.0, self.GMEAN_MIN)),
+            "bpref": bpref.sum() / nqueries,
+            "Rprec": rprec.sum() / nqueries,
+            "recip_rank": recip_rank.sum() / nqueries,
+        }
+        for v in cutoffs:
+            summary["P_%d" % (v)] = ps["P@%d" % (v)].sum() / nqueries
+        for v in cutoffs:
+            summary["NDCG_%d" % (v)] = ndcgs["NDCG@%d" % (v)].sum() / nqueries
+
+        results_per_query = []
+        if per_query:
+            per_query_values = [("bpref", bpref)]
+            for v in cutoffs:
+                per_query_values.append(("P_%d" % (v), ps["P@%d" % (v)]))
+                per_query_values.append(("NDCG_%d" % (v), ndcgs["NDCG@%d" % (v)]))
+            map_pq = self.__add_qrels_only_queries(values["MAP@1000"], matrix)
+            per_query_values += [("map", map_pq), ("num_ret", num_ret), ("num_rel", num_rel),
+                                 ("num_rel_ret", num_rel_ret), ("Rprec", rprec), ("recip_rank", recip_rank)]
+
+            for metric, values in per_query_values:
+                values = values.rename("value").rename_axis("query").reset_index()
+                values["metric"] = metric
+                results_per_query.append(values)
+
+        return self.__make_res(run_id, summary, results_per_query)
+
+    def __get_values_per_query(self, rows=None):
+        """
+            Returns a dataframe with the values per query of the metrics of evaluate_all(engine="single_pass"),
+            one row per query of the run. They are computed once and kept with the relevance matrices.
+            If 'rows' is given, only the values of the queries in these rows are computed (and not kept).
+        """
+        self.__check_relevance_matrices()
+        if rows is None and self.__values_per_query is not None:
+            return self.__values_per_query
+
+        # NDCG keeps the order of the run, all other metrics use the trec_eval order
+        run_order = self.get_relevance_matrix(trec_eval=False)
+        matrix = self.get_relevance_matrix(trec_eval=True)
+        if rows is not None:
+            run_order, matrix = run_order.select_rows(rows), matrix.select_rows(rows)
+
+        cutoffs = [5, 10, 15, 20, 30, 100, 200, 500, 1000]
+        values = pd.concat((matrix.get_precision(depths=cutoffs),
+                            run_order.get_ndcg(depths=cutoffs, trec_eval=True),
+                            matrix.get_map(depth=10000), matrix.get_map(depth=1000), matrix.get_bpref(depth=1000),
+                            matrix.get_rprec(depth=1000), matrix.get_reciprocal_rank(depth=1000),
+                            matrix.get_retrieved_documents(), matrix.get_relevant_retrieved_documents()), axis=1)
+        if rows is None:
+            self.__values_per_query = values
+        return values
+
+    def update_judgements(self, judgements):
+        """
+            Updates the relevance matrices and the values per query of evaluate_all(engine="single_pass") after
+            judgements were added to (or changed in) the qrels with TrecQrel.add_judgements. Only the queries of
+            these judgements are computed again. The other ones keep their values.
+            If nothing was evaluated before, or the run data changed, everything is computed again when needed.
+
+            Params
+            -------
+            judgements: the dataframe with cols (query, docid, rel) returned by TrecQrel.add_judgements
+
+            Returns
+            --------
+            An array with the queries of the run computed again
+        """
+        run_data, qrels_data = self.run.run_data, self.qrels.qrels_data
+        if self.__matrices_data[0] is not run_data or len(self.relevance_matrices) == 0:
+            self.__check_relevance_matrices()
+            return np.array([], dtype=object)
+
+        index = self.qrels.get_qrels_index()
+        if self.qrels_index is not None:
+            self.qrels_index = index
+            self.__qrels_index_data = qrels_data
+
+        queries, docids, rels = judgements["query"].values, judgements["docid"].values, judgements["rel"].values
+        for matrix in self.relevance_matrices.values():
+            rows = matrix.update_judgements(index, queries, docids, rels)
+        self.__matrices_data = (run_data, qrels_data)
+
+        if self.__values_per_query is None or len(rows) == 0:
+            return matrix.queries[rows]
+        values = self.__get_values_per_query(rows)
+        self.__values_per_query.loc[values.index, values.columns] = values
+        return matrix.queries[rows]
+
+    def get_relevance_matrix(self, trec_eval=True):
+        """
+            Returns the TrecRelevanceMatrix of the run joined with the qrels.
+            It is built only once and reused by the following calls (and by evaluate_all(engine="single_pass")),
+            until the run data or the qrels data are replaced (e.g., by TrecRun.load_run_from_dataframe,
+            TrecQrel.fill_up or TrecQrel.add_judgements) or another run or qrel is assigned to this object.
+            As for the lookups of TrecRun and TrecQrel, in-place edits of run_data or qrels_data are not detected.
+
+            Params
+            -------
+            trec_eval: set to True to sort documents as trec_eval does, e.g., by score first. Default = True.
+
+            Returns
+            --------
+            An TrecRelevanceMatrix object
+        """
+        self.__check_relevance_matrices()
+        if trec_eval not in self.relevance_matrices:
+            if trec_eval and False in self.relevance_matrices:
+                # Sorting an existing matrix is cheaper than merging the run with the qrels once more
+                self.relevance_matrices[True] = self.relevance_matrices[False].sort_by_score()
+            else:
+                qrels = self.qrels if self.qrels_index is None else self.qrels_index
+                self.relevance_matrices[trec_eval] = TrecRelevanceMatrix(self.run, qrels, trec_eval=trec_eval)
+        return self.relevance_matrices[trec_eval]
+
+    def __check_relevance_matrices(self):
+        """
+            Drops the cached relevance matrices if the run data or the qrels data were replaced since they were built.
+            A qrels_index given for older qrels data is not used anymore.
+        """
+        run_data, qrels_data = self.run.run_data, self.qrels.qrels_data
+        if self.__matrices_data[0] is not run_data or self.__matrices_data[1] is not qrels_data:
+            self.relevance_matrices = {}
+            self.__values_per_query = None
+            self.__matrices_data = (run_data, qrels_data)
+        if self.qrels_index is not None and self.__qrels_index_data is not qrels_data:
+            self.qrels_index = None
+
+    def __get_matrix(self, trec_eval=True, removeUnjudged=False):
+        matrix = self.get_relevance_matrix(trec_eval=trec_eval)
+        if removeUnjudged:
+            matrix = matrix.remove_unjudged()
+        return matrix
+
+    def __add_qrels_only_queries(self, values, matrix):
+        """
+            As in get_map and get_ndcg, queries with relevant documents that are not in the run show up with a NaN value.
+        """
+        num_rel = matrix.relevant_per_query
+        qrels_only = num_rel[num_rel > 0].index.difference(matrix.queries)
+        return values.reindex(values.index.union(qrels_only))
+
+    def __summarize_depths(self, values, depths, per_query):
+        """
+            Returns the per query dataframe with one col per depth, or a dict {depth: value} with the mean over all queries.
+        """
+        if per_query:
+            return values
+
+        # check number of queries
+        nqueries = len(self.run.topics())
+        return dict((d, values[col].sum() / nqueries) for d, col in zip(depths, values.columns))
+
     def get_retrieved_documents(self, per_query=False):
         """
             Returns the number retrieved documents
@@ -167,7 +374,7 @@ class TrecEval:
             else: returns the total number of retrieved documents for all queries.
 
         """
-        retrieved = self.run.run_data.groupby("query")["docid"].count()
+        retrieved = self.run.run_data.groupby("query", observed=True)["docid"].count()
         if per_query:
             return retrieved
         return retrieved.sum()
@@ -188,7 +395,7 @@ class TrecEval:
         """
         qrels = self.qrels.qrels_data.copy()
         qrels["relevant_per_query"] = qrels["rel"] > 0
-        total_rel_per_query = qrels.groupby("query")["relevant_per_query"].sum().astype(int)
+        total_rel_per_query = qrels.groupby("query", observed=True)["relevant_per_query"].sum().astype(int)
 
         if per_query:
             return total_rel_per_query
@@ -210,7 +417,7 @@ class TrecEval:
         """
         merged = pd.merge(self.run.run_data[["query","docid"]], self.qrels.qrels_data[["query","docid","rel"]])
 
-        result = merged[merged["rel"]>0].groupby("query")["rel"].count()
+        result = merged[merged["rel"]>0].groupby("query", observed=True)["rel"].count()
 
         if per_query:
             return result
@@ -228,9 +435,9 @@ class TrecEval:
 
         if trec_eval:
             trecformat = self.run.run_data.sort_values(["query", "score", "docid"], ascending=[True,False,False]).reset_index()
-            topX = trecformat.groupby("query")[["query","docid"]].head(depth)
+            topX = trecformat.groupby("query", observed=True)[["query","docid"]].head(depth)
         else:
-            topX = self.run.run_data.groupby("query")[["query","docid"]].head(depth)
+            topX = self.run.run_data.groupby("query", observed=True)[["query","docid"]].head(depth)
 
         # check number of queries
         nqueries = len(self.qrels.topics())
@@ -238,7 +445,7 @@ class TrecEval:
         selection = pd.merge(topX, self.qrels.qrels_data[["query","docid","rel"]], how="left")
         selection[label] = selection["rel"].isnull()
 
-        unjX_per_query = selection[["query", label]].groupby("query").sum().astype(int) / depth
+        unjX_per_query = selection[["query", label]].groupby("query", observed=True).sum().astype(int) / depth
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "UNJ@X"] values """
@@ -278,20 +485,21 @@ class TrecEval:
 
         if trec_eval:
             trecformat = self.run.run_data.sort_values(["query", "score", "docid"], ascending=[True,False,False]).reset_index()
-            topX = trecformat.groupby("query")[["query","docid","score"]].head(depth)
+            topX = trecformat.groupby("query", observed=True)[["query","docid","score"]].head(depth)
         else:
-            topX = self.run.run_data.groupby("query")[["query","docid","score"]].head(depth)
+            topX = self.run.run_data.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
 
         relevant_docs = qrels[qrels.rel > 0]
         selection = pd.merge(topX, relevant_docs[["query","docid","rel"]], how="left")
         # converting query to category makes it explicit when using groupby.
         # This way we end up with a group even if no relevant documents are found for a query.
-        selection["query"] = pd.Categorical(selection["query"])
-        selection = selection[~selection["rel"].isnull()].groupby("query").first().copy()
+        # The categories are made from the values, so that a categorical run does not bring queries it has not.
+        selection["query"] = pd.Categorical(np.asarray(selection["query"]))
+        selection = selection[~selection["rel"].isnull()].groupby("query", observed=False).first().copy()
         selection[label] = 1.0 / selection["rank"]
         recip_rank_per_query = selection[[label]]
 
@@ -351,29 +559,29 @@ class TrecEval:
 
         if trec_eval:
             trecformat = self.run.run_data.sort_values(["query", "score", "docid"], ascending=[True,False,False]).reset_index()
-            topX = trecformat.groupby("query")[["query","docid","score"]].head(depth)
+            topX = trecformat.groupby("query", observed=True)[["query","docid","score"]].head(depth)
         else:
-            topX = self.run.run_data.groupby("query")[["query","docid","score"]].head(depth)
+            topX = self.run.run_data.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # check number of queries
         nqueries = len(self.run.topics())
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
         topX["discount"] = 1. / np.log2(topX["rank"]+1)
 
         # Keep only documents that are relevant (rel > 0)
         selection = pd.merge(topX, relevant_docs[["query","docid","rel"]], how="left")
 
-        selection["rel"] = selection.groupby("query")["rel"].cumsum()
+        selection["rel"] = selection.groupby("query", observed=True)["rel"].cumsum()
         # contribution of each relevant document
         selection[label] = selection["rel"] / selection["rank"]
 
         # MAP is the sum of individual's contribution
-        map_per_query = selection[["query", label]].groupby("query").sum()
+        map_per_query = selection[["query", label]].groupby("query", observed=True).sum()
         relevant_docs[label] = relevant_docs["rel"]
-        nrel_per_query = relevant_docs[["query",label]].groupby("query").head(depth).groupby("query").sum()
+        nrel_per_query = relevant_docs[["query",label]].groupby("query", observed=True).head(depth).groupby("query", observed=True).sum()
         map_per_query = map_per_query / nrel_per_query
 
         if per_query:
@@ -416,21 +624,21 @@ class TrecEval:
 
         if trec_eval:
             trecformat = self.run.run_data.sort_values(["query", "score", "docid"], ascending=[True,False,False]).reset_index()
-            topX = trecformat.groupby("query")[["query","docid","score"]].head(depth)
+            topX = trecformat.groupby("query", observed=True)[["query","docid","score"]].head(depth)
         else:
-            topX = self.run.run_data.groupby("query")[["query","docid","score"]].head(depth)
+            topX = self.run.run_data.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # gets the number of relevant documents per query
         n_relevant_docs = self.get_relevant_documents(per_query = True)
 
         # Gets only the top R documents per topic:
-        topX = topX.groupby("query").apply(lambda x: x.head(n_relevant_docs.loc[x.name])).reset_index(drop=True)
+        topX = topX.groupby("query", observed=True).apply(lambda x: x.head(n_relevant_docs.loc[x.name])).reset_index(drop=True)
 
         relevant_docs = qrels[qrels.rel > 0]
         selection = pd.merge(topX, relevant_docs[["query","docid","rel"]], how="left")
         selection = selection[~selection["rel"].isnull()]
 
-        rprec_per_query = selection.groupby("query")["docid"].count() / n_relevant_docs
+        rprec_per_query = selection.groupby("query", observed=True)["docid"].count() / n_relevant_docs
         rprec_per_query.name = label
         rprec_per_query = rprec_per_query.reset_index().set_index("query")
 
@@ -443,7 +651,7 @@ class TrecEval:
         return (rprec_per_query.sum() / nqueries)[label]
 
 
-    def get_ndcg(self, depth=1000, per_query=False, trec_eval=True, removeUnjudged=False):
+    def get_ndcg(self, depth=1000, per_query=False, trec_eval=True, removeUnjudged=False, depths=None):
         """
             Calculates the normalized discounted cumulative gain (NDCG).
 
@@ -453,12 +661,21 @@ class TrecEval:
             trec_eval: set to True if result should be the same as trec_eval, e.g., sort documents by score first. Default = True.
             per_query: If True, runs the evaluation per query. Default = False
             removeUnjudged: set to True if you want to remove the unjudged documents before calculating this metric.
+            depths: a list of evaluation depths. If set, 'depth' is ignored and all depths are computed at once. Default = None
 
             Returns
             --------
             if per_query == True: returns a pandas dataframe with two cols (query, NDCG@d)
             else: returns a float value representing the RPrec.
+            If depths is set:
+            if per_query == True: returns a pandas dataframe with one col per depth (query, NDCG@d1, NDCG@d2, ...)
+            else: returns a dict {d: NDCG@d}
         """
+        if depths is not None:
+            # NDCG keeps the order of the run, trec_eval only changes the gain of each document
+            matrix = self.__get_matrix(False, removeUnjudged)
+            values = self.__add_qrels_only_queries(matrix.get_ndcg(depths=depths, trec_eval=trec_eval), matrix)
+            return self.__summarize_depths(values, depths, per_query)
 
         label = "NDCG@%d" % (depth)
 
@@ -474,11 +691,11 @@ class TrecEval:
             run = onlyjudged[["query","q0","docid","rank","score","system"]]
 
         # Select only topX documents per query
-        topX = run.groupby("query")[["query","docid","score"]].head(depth)
+        topX = run.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
         topX["discount"] = 1. / np.log2(topX["rank"]+1)
 
         # Keep only documents that are relevant (rel > 0)
@@ -494,10 +711,10 @@ class TrecEval:
 
         # Calculate IDCG
         perfect_ranking = relevant_docs.sort_values(["query","rel"], ascending=[True,False]).reset_index(drop=True)
-        perfect_ranking = perfect_ranking.groupby("query").head(depth)
+        perfect_ranking = perfect_ranking.groupby("query", observed=True).head(depth)
 
         perfect_ranking["rank"] = 1
-        perfect_ranking["rank"] = perfect_ranking.groupby("query")["rank"].cumsum()
+        perfect_ranking["rank"] = perfect_ranking.groupby("query", observed=True)["rank"].cumsum()
         perfect_ranking["discount"] = 1. / np.log2(perfect_ranking["rank"]+1)
         if trec_eval:
             perfect_ranking[label] = (perfect_ranking["rel"]) * perfect_ranking["discount"]
@@ -505,8 +722,8 @@ class TrecEval:
             perfect_ranking[label] = (2**perfect_ranking["rel"] - 1.0) * perfect_ranking["discount"]
 
         # DCG is the sum of individual's contribution
-        dcg_per_query = selection[["query", label]].groupby("query").sum()
-        idcg_per_query = perfect_ranking[["query",label]].groupby("query").sum()
+        dcg_per_query = selection[["query", label]].groupby("query", observed=True).sum()
+        idcg_per_query = perfect_ranking[["query",label]].groupby("query", observed=True).sum()
         ndcg_per_query = dcg_per_query / idcg_per_query
 
         if per_query:
@@ -545,8 +762,8 @@ class TrecEval:
 
         # number of relevant and non-relevant documents per query:
         qrels["is_rel_per_query"] = qrels["rel"] > 0
-        total_rel_per_query = qrels.groupby("query")["is_rel_per_query"].sum()
-        total_nrel_per_query = qrels.groupby("query")["is_rel_per_query"].count() - qrels.groupby("query")["is_rel_per_query"].sum()
+        total_rel_per_query = qrels.groupby("query", observed=True)["is_rel_per_query"].sum()
+        total_nrel_per_query = qrels.groupby("query", observed=True)["is_rel_per_query"].count() - qrels.groupby("query", observed=True)["is_rel_per_query"].sum()
         total_rel_per_query.name = "rels_per_query"
 
         # Denominator is the minimal of the two dataframes. Using 'where' clause as a 'min'
@@ -563,10 +780,10 @@ class TrecEval:
         merged = merged[~merged.rel.isnull()]
 
         # Select only topX documents per query
-        merged = merged.groupby("query")[["query","docid","rel"]].head(depth)
+        merged = merged.groupby("query", observed=True)[["query","docid","rel"]].head(depth)
 
         merged["is_nrel"] = merged["rel"] == 0
-        merged["nrel_so_far"] = merged.groupby("query")["is_nrel"].cumsum()
+        merged["nrel_so_far"] = merged.groupby("query", observed=True)["is_nrel"].cumsum()
 
         merged = pd.merge(merged, total_rel_per_query.reset_index(), on="query", how="left")
         merged = pd.merge(merged, denominator.reset_index(), on="query", how="left")
@@ -576,7 +793,7 @@ class TrecEval:
         # Accumulates scores only for relevant documents retrieved
         merged = merged[~merged["is_nrel"]]
 
-        bpref_per_query = merged[["query", label]].groupby("query").sum()
+        bpref_per_query = merged[["query", label]].groupby("query", observed=True).sum()
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "P@X"] values """
@@ -604,8 +821,8 @@ class TrecEval:
 
         # number of relevant and non-relevant documents per query:
         qrels["is_rel_per_query"] = qrels["rel"] > 0
-        total_rel_per_query = qrels.groupby("query")["is_rel_per_query"].sum()
-        total_nrel_per_query = qrels.groupby("query")["is_rel_per_query"].count() - qrels.groupby("query")["is_rel_per_query"].sum()
+        total_rel_per_query = qrels.groupby("query", observed=True)["is_rel_per_query"].sum()
+        total_nrel_per_query = qrels.groupby("query", observed=True)["is_rel_per_query"].count() - qrels.groupby("query", observed=True)["is_rel_per_query"].sum()
         total_rel_per_query.name = "rels_per_query"
 
         # Denominator is the minimal of the two dataframes. Using 'where' clause as a 'min'
@@ -622,10 +839,10 @@ class TrecEval:
         merged = merged[~merged.rel.isnull()]
 
         # Select only topX documents per query
-        merged = merged.groupby("query")[["query","docid","rel","rel_other"]].head(depth)
+        merged = merged.groupby("query", observed=True)[["query","docid","rel","rel_other"]].head(depth)
 
         merged["is_nrel"] = merged["rel"] == 0
-        merged["nrel_so_far"] = merged.groupby("query")["is_nrel"].cumsum()
+        merged["nrel_so_far"] = merged.groupby("query", observed=True)["is_nrel"].cumsum()
 
         merged = pd.merge(merged, total_rel_per_query.reset_index(), on="query", how="left")
         merged = pd.merge(merged, denominator.reset_index(), on="query", how="left")
@@ -635,14 +852,14 @@ class TrecEval:
         # Accumulates scores only for relevant documents retrieved
         merged = merged[~merged["is_nrel"]]
 
-        ubpref_per_query = merged[["query", label]].groupby("query").sum()
+        ubpref_per_query = merged[["query", label]].groupby("query", observed=True).sum()
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "P@X"] values """
             return ubpref_per_query
         return (ubpref_per_query.sum() / nqueries)[label]
 
-    def get_precision(self, depth=1000, per_query=False, trec_eval=True, removeUnjudged=False):
+    def get_precision(self, depth=1000, per_query=False, trec_eval=True, removeUnjudged=False, depths=None):
         """
             Calculates the binary precision at depth d (P@d).
 
@@ -652,13 +869,21 @@ class TrecEval:
             per_query: If True, runs the evaluation per query. Default = False
             trec_eval: set to True if result should be the same as trec_eval, e.g., sort documents by score first. Default = True.
             removeUnjudged: set to True if you want to remove the unjudged documents before calculating this metric.
+            depths: a list of evaluation depths. If set, 'depth' is ignored and all depths are computed at once. Default = None
 
             Returns
             --------
             if per_query == True: returns a pandas dataframe with two cols (query, P@d)
             else: returns a float value representing the RPrec.
+            If depths is set:
+            if per_query == True: returns a pandas dataframe with one col per depth (query, P@d1, P@d2, ...)
+            else: returns a dict {d: P@d}
 
         """
+        if depths is not None:
+            values = self.__get_matrix(trec_eval, removeUnjudged).get_precision(depths=depths)
+            return self.__summarize_depths(values, depths, per_query)
+
         label = "P@%d" % (depth)
 
         # check number of queries
@@ -675,15 +900,42 @@ class TrecEval:
         if removeUnjudged:
             merged = merged[~merged.rel.isnull()]
 
-        topX = merged.groupby("query")[["query","docid","rel"]].head(depth)
+        topX = merged.groupby("query", observed=True)[["query","docid","rel"]].head(depth)
         topX[label] = topX["rel"] > 0
-        pX_per_query = topX[["query", label]].groupby("query").sum().astype(int) / depth
+        pX_per_query = topX[["query", label]].groupby("query", observed=True).sum().astype(int) / depth
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "P@X"] values """
             return pX_per_query
         return (pX_per_query.sum() / nqueries)[label]
 
+    def get_recall(self, depth=1000, per_query=False, trec_eval=True, removeUnjudged=False, depths=None):
+        """
+            Calculates the recall at depth d (Recall@d), i.e., the fraction of the relevant documents retrieved among the
+            top d documents.
+
+            Params
+            -------
+            depth: the evaluation depth. Default = 1000
+            per_query: If True, runs the evaluation per query. Default = False
+            trec_eval: set to True if result should be the same as trec_eval, e.g., sort documents by score first. Default = True.
+            removeUnjudged: set to True if you want to remove the unjudged documents before calculating this metric.
+            depths: a list of evaluation depths. If set, 'depth' is ignored and all depths are computed at once. Default = None
+
+            Returns
+            --------
+            if per_query == True: returns a pandas dataframe with two cols (query, Recall@d)
+            else: returns a float value representing the Recall@d.
+            If depths is set:
+            if per_query == True: returns a pandas dataframe with one col per depth (query, Recall@d1, Recall@d2, ...)
+            else: returns a dict {d: Recall@d}
+        """
+        matrix = self.__get_matrix(trec_eval, removeUnjudged)
+        values = self.__add_qrels_only_queries(matrix.get_recall(depths=[depth] if depths is None else depths), matrix)
+        if depths is None:
+            return values if per_query else self.__summarize_depths(values, [depth], per_query)[depth]
+        return self.__summarize_depths(values, depths, per_query)
+
     def get_rbp(self, p=0.8, depth=1000, per_query=False, binary_topical_relevance=True, average_ties=True, removeUnjudged=False):
         """
             Calculates the rank-bias precision at depth d (RBP@d) with persistece paramter p.
@@ -718,11 +970,11 @@ class TrecEval:
             run = onlyjudged[["query","q0","docid","rank","score","system"]]
 
         # Select only topX documents per query
-        topX = run.groupby("query")[["query","docid","score"]].head(depth)
+        topX = run.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
 
         # Calculate RBP based on rank of documents
         topX[label] = (1.0-p) * (p) ** (topX["rank"]-1)
@@ -752,8 +1004,8 @@ class TrecEval:
             selection[label] = selection[label] * selection["rel"]
 
         # RBP is the sum of individual's contribution
-        rbp_per_query = selection[["query", label]].groupby("query").sum()
-        rbp_res_per_query = residuals[["query", label]].groupby("query").sum()
+        rbp_per_query = selection[["query", label]].groupby("query", observed=True).sum()
+        rbp_res_per_query = residuals[["query", label]].groupby("query", observed=True).sum()
 
         if per_query:
             return rbp_per_query, rbp_res_per_query - rbp_per_query + p**depth
@@ -791,11 +1043,11 @@ class TrecEval:
             run = onlyjudged[["query","q0","docid","rank","score","system"]]
 
         # Select only topX documents per query
-        topX = run.groupby("query")[["query","docid","score"]].head(depth)
+        topX = run.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
 
         # Calculate RBP based on rank of documents
         topX[label] = (1.0-p) * (p) ** (topX["rank"]-1)
@@ -824,7 +1076,7 @@ class TrecEval:
             selection[label] = selection[label] * selection["rel"]
 
         # RBP is the sum of individual's contribution
-        rbp_per_query = selection[["query", label]].groupby("query").sum()
+        rbp_per_query = selection[["query", label]].groupby("query", observed=True).sum()
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "RBP"] values """
@@ -855,14 +1107,14 @@ class TrecEval:
         label = "auRBP(%.2f)@%d" % (p, depth)
 
         # Select only topX documents per query
-        topX = self.run.run_data.groupby("query")[["query","docid","score"]].head(depth)
+        topX = self.run.run_data.groupby("query", observed=True)[["query","docid","score"]].head(depth)
 
         # check number of queries
         nqueries = len(self.qrels.topics())
 
         # Make sure that rank position starts by 1
         topX["rank"] = 1
-        topX["rank"] = topX.groupby("query")["rank"].cumsum()
+        topX["rank"] = topX.groupby("query", observed=True)["rank"].cumsum()
 
         # Calculate RBP based on rank of documents
         topX[label] = (1.0-p) * (p) ** (topX["rank"]-1)
@@ -906,7 +1158,7 @@ class TrecEval:
             selection[label] = selection[label] * selection["rel"]
 
         # RBP is the sum of individual's contribution
-        rbp_per_query = selection[["query", label]].groupby("query").sum()
+        rbp_per_query = selection[["query", label]].groupby("query", observed=True).sum()
 
         if per_query:
             """ This will return a pandas dataframe with ["query", "RBP"] values """
@@ -0,0 +1,49 @@
+from trectools import TrecEval
+
+
+class TrecIncrementalEval:
+
+    def __init__(self, list_of_runs, trec_qrel, per_query=False):
+        """
+            Keeps the evaluation of many runs up to date while judgements are added to a qrel, e.g., during an
+            assessment campaign. The relevance matrices of the runs (see TrecRelevanceMatrix) are built once.
+            After that, each batch of judgements only patches the qrel index, the positions of the judged documents
+            and the number of relevant documents and ideal gains of their topics (see TrecEval.update_judgements).
+            Only the metrics of these topics are computed again, the other topics keep their values.
+
+            Params
+            -------
+            list_of_runs: list of TrecRun objects
+            trec_qrel: an object of type TrecQrel. It is updated by add_judgements.
+            per_query: If True, the results include the values per query. Default = False
+        """
+        self.qrels = trec_qrel
+        self.per_query = per_query
+        self.evaluators = [TrecEval(run, trec_qrel, qrels_index=trec_qrel.get_qrels_index()) for run in list_of_runs]
+        self.results = [e.evaluate_all(per_query=per_query, engine="single_pass") for e in self.evaluators]
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "Incremental evaluation of %d runs." % (len(self.evaluators))
+
+    def add_judgements(self, judgements):
+        """
+            Adds new judgements (or changes existing ones) and updates the results of all runs.
+            judgements: a pandas dataframe with cols (query, docid, rel), or a list of (query, docid, rel) tuples.
+
+            Returns a list with the updated TrecRes of each run.
+        """
+        judgements = self.qrels.add_judgements(judgements)
+        for e in self.evaluators:
+            e.update_judgements(judgements)
+
+        self.results = [e.evaluate_all(per_query=self.per_query, engine="single_pass") for e in self.evaluators]
+        return self.results
+
+    def get_results(self):
+        """
+            Returns a list with the TrecRes of each run, for the judgements added so far.
+        """
+        return self.results
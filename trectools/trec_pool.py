@@ -1,24 +1,79 @@
 # TODO: use logging properly
 import logging
 import os
+from itertools import chain
 
 # External libraries
 import numpy as np
+import pandas as pd
 
 
 class TrecPool:
 
-    def __init__(self, pool):
-        self.pool = pool
+    def __init__(self, pool=None, codes=None, docids=None):
+        """
+            A pool is either given as a dict topic -> set of document names ('pool'), or in its compact form (see compact()):
+            'codes' is a dict topic -> sorted array of unique integer codes into 'docids', the array with the names of all
+            documents of the pool, shared by all topics.
+        """
+        if codes is not None:
+            self.__pool = None
+            self.__codes = codes
+            self.__docids = np.asarray(docids, dtype=object)
+        else:
+            self.pool = pool if pool is not None else {}
 
     def __repr__(self):
         return self.__str__()
 
     def __str__(self):
-        return "Pool with %d topics. Total of %d unique documents."  % (len(self.pool), self.get_total_pool_size())
+        return "Pool with %d topics. Total of %d unique documents."  % (len(self.get_topics()), self.get_total_pool_size())
+
+    @property
+    def pool(self):
+        """
+            The pool as a dict topic -> set of document names. A compact pool builds the dict on first use and stops
+            being compact, since the dict can be changed in place. Call compact() again to get the compact form back.
+        """
+        if self.is_compact():
+            pool = {topic: set(self.__docids[codes]) for topic, codes in self.__codes.items()}
+            self.pool = pool
+        return self.__pool
+
+    @pool.setter
+    def pool(self, pool):
+        self.__pool = pool
+        self.__codes = None
+        self.__docids = None
+
+    def is_compact(self):
+        return self.__codes is not None
+
+    def compact(self):
+        """
+            Returns this pool in its compact form: the documents of each topic are a sorted array of integer codes into
+            one array of document names shared by all topics. Pool operations (minus, plus, exclusive) on compact pools
+            are made with numpy set routines on these arrays. Reading the 'pool' dict turns a compact pool back into a
+            dict pool.
+        """
+        if self.is_compact():
+            return self
+
+        documents = [list(docs) for docs in self.__pool.values()]
+        all_codes, docids = pd.factorize(np.asarray(list(chain.from_iterable(documents)), dtype=object))
+        all_codes = all_codes.astype(np.int32 if len(docids) < 2 ** 31 else np.int64)
+        ends = np.cumsum([len(docs) for docs in documents], dtype=np.int64)
+        codes = {topic: np.sort(all_codes[end - len(docs):end])
+                 for topic, docs, end in zip(self.__pool.keys(), documents, ends)}
+        return TrecPool(codes=codes, docids=docids)
+
+    def get_topics(self):
+        return list(self.__codes.keys()) if self.is_compact() else list(self.__pool.keys())
 
     def get_size_per_topic(self):
-        return [len(k) for k in list(self.pool.values())]
+        if self.is_compact():
+            return [len(codes) for codes in self.__codes.values()]
+        return [len(k) for k in list(self.__pool.values())]
 
     def get_total_pool_size(self):
         return np.sum(self.get_size_per_topic())
@@ -27,26 +82,64 @@ class TrecPool:
         return np.mean(self.get_size_per_topic())
 
     def operate_pools(self, another_pool, operation, inplace=False):
-        if list(self.pool.keys()) != list(another_pool.pool.keys()):
+        """
+            Applies 'operation' (minus, sum, exclusive) to the documents of each topic of the two pools.
+            Both pools must have the same topics. If one of them is compact, the result is compact.
+        """
+        if set(self.get_topics()) != set(another_pool.get_topics()):
             print("Error: Key set is different")
             return None
+        if operation not in ["minus", "sum", "exclusive"]:
+            print("Operation %s is not supported" % (str(operation)))
+            return None
+
+        if self.is_compact() or another_pool.is_compact():
+            result = self.__operate_compact(another_pool, operation)
+        else:
+            presult = {}
+            for k in list(self.pool.keys()):
+                sa = self.pool[k]
+                sb = another_pool.pool[k]
+                if operation == "minus":
+                    presult[k] = sa - sb
+                elif operation == "sum":
+                    presult[k] = sa.union(sb)
+                elif operation == "exclusive":
+                    presult[k] = sa ^ sb
+            result = TrecPool(presult)
 
-        presult = {}
-        for k in list(self.pool.keys()):
-            sa = self.pool[k]
-            sb = another_pool.pool[k]
-            if operation == "minus":
-                presult[k] = sa - sb
-            elif operation == "sum":
-                presult[k] = sa.union(sb)
-            elif operation == "exclusive":
-                presult[k] = sa ^ sb
-            else:
-                print("Operation %s is not supported" % (str(operation)))
         if inplace:
-            self.pool = presult
+            self.__pool, self.__codes, self.__docids = result.__pool, result.__codes, result.__docids
+        else:
+            return result
+
+    def __operate_compact(self, another_pool, operation):
+        pool_a, pool_b = self.compact(), another_pool.compact()
+        codes_a, codes_b = pool_a.__codes, pool_b.__codes
+
+        # Pools with different document arrays are mapped to one array with the documents of both. Pools made by
+        # operations on compact pools extend the document array of their operands, so it is often a prefix of the other.
+        docids_a, docids_b = pool_a.__docids, pool_b.__docids
+        if docids_a is docids_b:
+            docids = docids_a
+        elif len(docids_a) < len(docids_b):
+            docids = docids_b if np.array_equal(docids_a, docids_b[:len(docids_a)]) else None
+        else:
+            docids = docids_a if np.array_equal(docids_a[:len(docids_b)], docids_b) else None
+        if docids is None:
+            map_b = pd.Index(docids_a).get_indexer(docids_b)
+            missing = map_b < 0
+            map_b[missing] = len(docids_a) + np.arange(missing.sum())
+            docids = np.concatenate((docids_a, docids_b[missing]))
+            codes_b = {topic: np.sort(map_b[codes]) for topic, codes in codes_b.items()}
+
+        if operation == "minus":
+            codes = {k: np.setdiff1d(codes_a[k], codes_b[k], assume_unique=True) for k in codes_a}
+        elif operation == "sum":
+            codes = {k: np.union1d(codes_a[k], codes_b[k]) for k in codes_a}
         else:
-            return TrecPool(presult)
+            codes = {k: np.setxor1d(codes_a[k], codes_b[k], assume_unique=True) for k in codes_a}
+        return TrecPool(codes=codes, docids=docids)
 
     def minus(self, another_pool, inplace=False):
         if inplace:
@@ -60,6 +153,12 @@ class TrecPool:
         else:
             return self.operate_pools(another_pool, "sum", inplace)
 
+    def exclusive(self, another_pool, inplace=False):
+        if inplace:
+            self.operate_pools(another_pool, "exclusive", inplace)
+        else:
+            return self.operate_pools(another_pool, "exclusive", inplace)
+
     def export_document_list(self, filename, with_format="relevation"):
         """
         Export a list of documents from the pool.
@@ -71,6 +170,13 @@ class TrecPool:
                 for query, documents in sorted(iter(list(self.pool.items())), key=lambda x: x[0]):
                     for doc in sorted(documents):
                         fout.write("%s\tQ0\t%s\t0\t0\ttrectools\n" % (str(query), str(doc)))
+        elif with_format == "filelist" and self.is_compact():
+            codes = list(self.__codes.values())
+            documents = sorted(self.__docids[np.unique(np.concatenate(codes))]) if codes else []
+
+            with open(filename, "w") as fout:
+                for doc in documents:
+                    fout.write(doc + "\n")
         elif with_format == "filelist":
             documents = set([])
             for docs in list(self.pool.values()):
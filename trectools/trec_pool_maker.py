@@ -1,6 +1,7 @@
 import pandas as pd
 
 from trectools import TrecPool, TrecRun
+from trectools.trec_run import align_topics
 
 
 class TrecPoolMaker:
@@ -54,40 +55,28 @@ class TrecPoolMaker:
         elif strategy == "rrf":
             return self.__make_pool_rrf(list_of_runs, topX=topX, rrf_den=rrf_den)
 
+    def make_pool_by_topic(self, topic_streams, strategy="topX", topX=10, rbp_strategy="sum", rbp_p=0.80, rrf_den=60,
+                           key=None):
+        """
+            Same as make_pool, but the runs are given as streams of per topic runs (see trec_run.read_run_by_topic),
+            all sorted by topic in the same order. Only one topic of each run is kept in memory at a time.
+            key: the order of the topics in the streams. Default: None (the order of TrecRun or the numeric one,
+                 see trec_run.align_topics)
+        """
+        pool = {}
+        for topic, runs in align_topics(topic_streams, key=key):
+            pool.update(self.make_pool(runs, strategy, topX=topX, rbp_p=rbp_p, rbp_strategy=rbp_strategy, rrf_den=rrf_den).pool)
+        return TrecPool(pool)
+
     def __make_pool_rrf(self, list_of_runs, topX=500, rrf_den=60):
         """
             topX = Number of documents per query. Default: 500.
             rrf_den = Value for the Reciprocal Rank Fusion denominator. Default is 60 as in the original paper:
             Reciprocal Rank Fusion outperforms Condorcet and individual Rank Learning Methods. G. V. Cormack. University of Waterloo. Waterloo, Ontario, Canada.
         """
-
-        big_df = pd.DataFrame(columns=["query", "docid", "rbp_value"])
-
-        for run in list_of_runs:
-            df = run.run_data.copy()
-            # NOTE: Everything is made based on the rank col. It HAS TO start by '1'
-            df["rrf_value"] = 1.0 / (rrf_den + df["rank"])
-            # Concatenate all dfs into a single big_df
-            big_df = pd.concat((big_df, df[["query", "docid", "rrf_value"]]), sort=True)
-
+        # NOTE: Everything is made based on the rank col. It HAS TO start by '1'
         # Default startegy is the sum.
-        grouped_by_docid = big_df.groupby(["query", "docid"])["rrf_value"].sum().reset_index()
-
-        # Sort documents by rbp value inside each qid group
-        grouped_by_docid.sort_values(by=["query", "rrf_value"], ascending=[True, False], inplace=True)
-
-        # Selects only the top X from each query
-        result = grouped_by_docid.groupby("query").head(topX)
-
-        # Transform pandas data into a dictionary
-        pool = {}
-        for row in result[["query", "docid"]].itertuples():
-            q = int(row.query)
-            if q not in pool:
-                pool[q] = set([])
-            pool[q].add(row.docid)
-
-        return TrecPool(pool)
+        return self.__make_pool_by_value(list_of_runs, lambda rank: 1.0 / (rrf_den + rank), topX, "sum")
 
     def __make_pool_rbp(self, list_of_runs, topX=100, p=0.80, strategy="sum"):
         """
@@ -95,51 +84,49 @@ class TrecPoolMaker:
             Strategy = (max, sum). Default: "sum"
             topX = Number of documents per query to be used in the pool. Default: 100
         """
+        if strategy not in ["sum", "max"]:
+            print("Strategy '%s' does not exist. Options are 'sum' and 'max'" % (strategy))
+            return None
 
-        big_df = pd.DataFrame(columns=["query", "docid", "rbp_value"])
+        # NOTE: Everything is made based on the rank col. It HAS TO start by '1'
+        return self.__make_pool_by_value(list_of_runs, lambda rank: (1.0 - p) * (p) ** (rank - 1), topX, strategy)
 
+    def __make_pool_by_value(self, list_of_runs, value_function, topX, strategy):
+        """
+            Pools the topX documents of each query with the largest value, where the value of a document is the
+            sum (or max) over all runs of value_function(rank).
+        """
+        if len(list_of_runs) == 0:
+            return TrecPool({})
+
+        # Only the needed columns of each run are copied, and the copies are concatenated once
+        frames = []
         for run in list_of_runs:
-            df = run.run_data.copy()
-            # NOTE: Everything is made based on the rank col. It HAS TO start by '1'
-            df["rbp_value"] = (1.0 - p) * (p) ** (df["rank"] - 1)
-            # Concatenate all dfs into a single big_df
-            big_df = pd.concat((big_df, df[["query", "docid", "rbp_value"]]))
+            df = run.run_data[["query", "docid"]].copy()
+            df["value"] = value_function(run.run_data["rank"].values)
+            frames.append(df)
+        big_df = pd.concat(frames, ignore_index=True)
 
         # Choose strategy for merging the different runs.
-        if strategy == "sum":
-            grouped_by_docid = big_df.groupby(["query", "docid"])["rbp_value"].sum().reset_index()
-        elif strategy == "max":
-            grouped_by_docid = big_df.groupby(["query", "docid"])["rbp_value"].max().reset_index()
-        else:
-            print("Strategy '%s' does not exist. Options are 'sum' and 'max'" % (strategy))
+        grouped_by_docid = big_df.groupby(["query", "docid"], observed=True)["value"].agg(strategy).reset_index()
 
-        # Sort documents by rbp value inside each qid group
-        grouped_by_docid.sort_values(by=["query", "rbp_value"], ascending=[True, False], inplace=True)
+        # Sort documents by value inside each qid group. The stable sort keeps ties in docid order.
+        grouped_by_docid.sort_values(by=["query", "value"], ascending=[True, False], kind="mergesort", inplace=True)
 
         # Selects only the top X from each query
-        result = grouped_by_docid.groupby("query").head(topX)
+        result = grouped_by_docid.groupby("query", observed=True).head(topX)
 
         # Transform pandas data into a dictionary
-        pool = {}
-        for row in result[["query", "docid"]].itertuples():
-            q = int(row.query)
-            if q not in pool:
-                pool[q] = set([])
-            pool[q].add(row.docid)
-
-        return TrecPool(pool)
+        pool = result.groupby("query", observed=True)["docid"].agg(set).to_dict()
+        return TrecPool({int(q): docs for q, docs in pool.items()})
 
     def __make_pool_topX(self, list_of_runs, cutoff=10):
-        pool_documents = {}
         if len(list_of_runs) == 0:
-            return TrecPool(pool_documents)
+            return TrecPool({})
 
-        topics_seen = set([])
-        for run in list_of_runs:
-            topics_seen = topics_seen.union(run.topics())
-            for t in topics_seen:
-                if t not in pool_documents.keys():
-                    pool_documents[t] = set([])
-                pool_documents[t] = pool_documents[t].union(run.get_top_documents(t, n=cutoff))
+        # Top documents of each topic of each run, in the order of get_top_documents
+        top_documents = pd.concat([run.run_data.groupby("query", sort=False, observed=True).head(cutoff)[["query", "docid"]]
+                                   for run in list_of_runs]).drop_duplicates()
 
+        pool_documents = top_documents.groupby("query", observed=True)["docid"].agg(set).to_dict()
         return TrecPool(pool_documents)
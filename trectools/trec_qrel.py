@@ -13,9 +13,14 @@ import numpy as np
 from sklearn import metrics
 from scipy.stats import ttest_ind
 
+from trectools import trec_cache
+from trectools.trec_relevance_matrix import TrecQrelIndex
+
 
 class TrecQrel:
     def __init__(self, filename=None, qrels_header=["query","q0","docid","rel"]):
+        # Lazily built lookup structures, see get_judgement
+        self.__reset_index()
 
         #TODO: support to check whether the fields match.
         if filename:
@@ -73,16 +78,28 @@ class TrecQrel:
         dslice[["query", "q0", "docid", "rel"]].to_csv(filename, sep=" ", header=False, index=False)
         print("File %s writen." % (filename))
 
-    def read_qrel(self, filename, qrels_header=None):
+    def read_qrel(self, filename, qrels_header=None, cache=False):
+        """
+            Reads qrels in TREC format from 'filename'.
+            With cache=True (or the path of a cache directory) the parsed qrels are stored in a
+            binary sidecar file and later reads of the unchanged file load them from there.
+        """
         # Replace with default argument for qrel_header
         if qrels_header is None:
             qrels_header = ["query", "q0", "docid", "rel"]
 
         # Set filename
         self.filename = filename
+        self.__reset_index()
+
+        if cache:
+            options = ("qrel", list(qrels_header))
+            self.qrels_data = trec_cache.load_cached_frame(filename, options, cache)
+            if self.qrels_data is not None:
+                return
 
         # Read data from file
-        self.qrels_data = pd.read_csv(filename, sep="\s+", names=qrels_header)
+        self.qrels_data = pd.read_csv(filename, sep=r"\s+", names=qrels_header)
 
         # Enforce string type on docid column (if present)
         if "docid" in self.qrels_data:
@@ -97,6 +114,9 @@ class TrecQrel:
         # Removes the files that were not judged:
         self.qrels_data = self.qrels_data[self.qrels_data["rel"] >= 0]
 
+        if cache:
+            trec_cache.store_cached_frame(filename, options, self.qrels_data, cache)
+
     def compare_with(self, another_qrel, topics=None):
         """
             Compare two qrels for a given set of topics.
@@ -145,6 +165,55 @@ class TrecQrel:
             new_data = another_qrel.qrels_data[another_qrel.qrels_data["query"] == topic]
             self.qrels_data = pd.concat((self.qrels_data,new_data))
             logging.warning("Added topic %s" % str(topic))
+        self.__reset_index()
+
+    def add_judgements(self, judgements):
+        """
+            Adds new judgements, or changes the label of documents that were already judged.
+            judgements: a pandas dataframe with cols (query, docid, rel), or a list of (query, docid, rel) tuples.
+            Labels must be non-negative integers (read_qrel drops negative labels, used for unjudged documents).
+            If a document is given more than once, its last label is kept. Other cols of qrels_data (e.g., q0) are
+            filled with "0" for q0 and NaN otherwise.
+
+            Returns the dataframe of the judgements added or changed, with cols (query, docid, rel).
+        """
+        if not isinstance(judgements, pd.DataFrame):
+            judgements = pd.DataFrame(list(judgements), columns=["query", "docid", "rel"])
+        for df, name in [(judgements, "judgements"), (self.qrels_data, "qrels_data")]:
+            if df is not None and not set(["query", "docid", "rel"]).issubset(df.columns):
+                raise ValueError("%s must have the cols query, docid and rel, got %s" % (name, list(df.columns)))
+
+        rels = pd.to_numeric(judgements["rel"], errors="coerce")
+        if rels.isna().any() or (rels != np.floor(rels)).any() or (rels < 0).any():
+            raise ValueError("Relevance labels must be non-negative integers, got %s" %
+                             (list(judgements["rel"][rels.isna() | (rels != np.floor(rels)) | (rels < 0)].unique())))
+        judgements = pd.DataFrame({"query": judgements["query"].astype(str).values,
+                                   "docid": judgements["docid"].astype(str).values,
+                                   "rel": rels.astype(int).values})
+        judgements = judgements.drop_duplicates(["query", "docid"], keep="last").reset_index(drop=True)
+
+        # A TrecQrelIndex already built is updated for the queries of the judgements instead of built again
+        index = self.__qrels_index if self.qrels_data is not None and self.__index_data is self.qrels_data else None
+        if self.qrels_data is None:
+            self.qrels_data = judgements.assign(q0="0")[["query", "q0", "docid", "rel"]]
+        else:
+            new_data = judgements.reindex(columns=self.qrels_data.columns)
+            if "q0" in new_data:
+                new_data["q0"] = "0"
+            replaced = self.qrels_data[["query", "docid"]].merge(judgements[["query", "docid"]].assign(replaced=True),
+                                                                 how="left")["replaced"].notna().values
+            if index is not None:
+                # The index keeps only the first label of a repeated pair, so it cannot remove all of them
+                judged = ~np.isnan(index.get_judgements(judgements["query"].values, judgements["docid"].values))
+                if judged.sum() != replaced.sum():
+                    index = None
+            self.qrels_data = pd.concat((self.qrels_data[~replaced], new_data), ignore_index=True)
+        self.__reset_index()
+        if index is not None:
+            index.update_judgements(judgements["query"].values, judgements["docid"].values, judgements["rel"].values)
+            self.__index_data = self.qrels_data
+            self.__qrels_index = index
+        return judgements
 
     def get_full_filename_path(self):
         return os.path.abspath(os.path.expanduser(self.filename))
@@ -285,22 +354,72 @@ class TrecQrel:
 
         return r[["query", "q0", "docid", "rel"]]
 
+    def __reset_index(self):
+        self.__index_data = None
+        self.__judgements = None
+        self.__duplicated_judgements = None
+        self.__documents_per_topic = None
+        self.__qrels_index = None
+
+    def __check_index(self):
+        """
+            Drops the lookup structures if qrels_data was replaced since they were built.
+            NOTE: the check is made on the identity of the dataframe. In-place edits of qrels_data
+            (e.g., qrels_data.loc[...] = ...) are not detected and the lookups keep returning the old
+            judgements. Assign a new dataframe to qrels_data instead (e.g., qrels_data = qrels_data.copy()).
+        """
+        if self.__index_data is not self.qrels_data:
+            self.__reset_index()
+            self.__index_data = self.qrels_data
+
+    def __get_judgements_map(self):
+        """
+            Returns a dict {(topic, document): rel}, built once and reused until qrels_data changes.
+        """
+        self.__check_index()
+        if self.__judgements is None:
+            pairs = self.qrels_data[["query", "docid"]]
+            duplicated = pairs.duplicated(keep=False).values
+            self.__duplicated_judgements = set(zip(pairs["query"].values[duplicated], pairs["docid"].values[duplicated]))
+            self.__judgements = dict(zip(zip(pairs["query"].values, pairs["docid"].values), self.qrels_data["rel"].values))
+        return self.__judgements
+
+    def get_qrels_index(self):
+        """
+            Returns a TrecQrelIndex of this qrel, built once and reused until qrels_data changes.
+        """
+        self.__check_index()
+        if self.__qrels_index is None:
+            self.__qrels_index = TrecQrelIndex(self)
+        return self.__qrels_index
+
     def get_judgement(self, document, topic):
         """
         Returns "rel" value if the pair document-topic is found.
         Else, returns -1.
         """
-        returned = self.qrels_data.loc[(self.qrels_data["docid"] == document) & (self.qrels_data["query"] == topic)]
-        if returned.shape[0] > 1:
+        judgements = self.__get_judgements_map()
+        if (topic, document) in self.__duplicated_judgements:
             print("ERROR: more than one value returned.")
-            return returned
-        elif returned.shape[0] == 1:
-            return returned["rel"].values[0]
-        else:
-            return -1
+            return self.qrels_data.loc[(self.qrels_data["docid"] == document) & (self.qrels_data["query"] == topic)]
+        return judgements.get((topic, document), -1)
+
+    def get_judgements(self, documents, topics):
+        """
+            Vectorized get_judgement for many document-topic pairs.
+            Returns an array with the "rel" value of each pair, or -1 if the pair is not found.
+            If a pair is judged more than once, its first judgement is used.
+        """
+        rels = self.get_qrels_index().get_judgements(topics, documents)
+        return np.where(np.isnan(rels), -1, rels).astype(self.qrels_data["rel"].dtype)
 
     def get_document_names_for_topic(self, topicX):
         """
             return a set with the names of all documents judged for topic X.
+            The sets of all topics are built once and reused until qrels_data is replaced (in-place edits of
+            qrels_data are not detected). Each call returns a new set, that can be changed by the caller.
         """
-        return set(self.qrels_data[self.qrels_data["query"] == topicX]["docid"])
+        self.__check_index()
+        if self.__documents_per_topic is None:
+            self.__documents_per_topic = self.qrels_data.groupby("query")["docid"].agg(frozenset).to_dict()
+        return set(self.__documents_per_topic.get(topicX, frozenset()))
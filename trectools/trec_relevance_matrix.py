@@ -0,0 +1,531 @@
+# External libraries
+import numpy as np
+import pandas as pd
+
+
+def _discount(n):
+    """
+        Returns the NDCG discounts 1 / log2(rank + 1) of the first n rank positions.
+    """
+    return 1. / np.log2(np.arange(2, n + 2))
+
+
+def _widen(values, width, repeat_last=False):
+    """
+        Returns a copy of the matrix 'values' with 'width' cols. The new cols are zeros (e.g., ideal gains)
+        or repeat the last col (e.g., ideal DCG, that does not change after the last relevant document).
+    """
+    extra = width - values.shape[1]
+    if extra <= 0:
+        return values.copy()
+    if repeat_last and values.shape[1] > 0:
+        fill = np.repeat(values[:, -1:], extra, axis=1)
+    else:
+        fill = np.zeros((values.shape[0], extra))
+    return np.hstack((values, fill))
+
+
+def _judgement_keys(queries, docids):
+    # Documents names cannot contain whitespaces in the TREC formats
+    return pd.Series(queries).astype(str).values + "\t" + pd.Series(docids).astype(str).values
+
+
+class TrecQrelIndex:
+
+    def __init__(self, qrels):
+        """
+            TrecQrelIndex precomputes everything that the evaluation needs from a qrel, so that it can be shared by
+            many runs (see TrecEval and procedures.evaluate_runs_batch).
+
+            Params
+            -------
+            qrels: an object of type TrecQrel
+
+            Attributes
+            --------
+            queries: array (Q) with the queries of the qrel, sorted
+            relevant_per_query: pandas series with the number of relevant documents (R) per query
+            nonrelevant_per_query: pandas series with the number of judged non-relevant documents per query
+            ideal_gains: float matrix (Q x max R) with the relevance labels of the relevant documents, sorted descending
+            ideal_dcg: float matrix (Q x max R) with the DCG of the ideal ranking at each cutoff (linear gains)
+        """
+        qrels_data = qrels.qrels_data
+
+        is_rel = qrels_data["rel"] > 0
+        self.relevant_per_query = is_rel.groupby(qrels_data["query"]).sum().astype(int)
+        self.nonrelevant_per_query = (~is_rel).groupby(qrels_data["query"]).sum().astype(int)
+        self.queries = np.asarray(self.relevant_per_query.index)
+
+        # Hash index (query, docid) -> rel. Only the first judgement of a repeated pair is kept.
+        keys = pd.Index(_judgement_keys(qrels_data["query"], qrels_data["docid"]))
+        unique = ~keys.duplicated()
+        self.judgements = keys[unique]
+        self.rels = qrels_data["rel"].values[unique].astype(float)
+
+        # Relevance labels of the relevant documents, sorted descending, for the ideal rankings (IDCG)
+        relevant_docs = qrels_data[is_rel].sort_values(["query", "rel"], ascending=[True, False])
+        rows = np.searchsorted(self.queries, relevant_docs["query"].values)
+        positions = relevant_docs.groupby("query").cumcount().values
+        max_rel = self.relevant_per_query.max() if len(self.queries) > 0 else 0
+        self.ideal_gains = np.zeros((len(self.queries), max_rel))
+        self.ideal_gains[rows, positions] = relevant_docs["rel"].values
+        self.ideal_dcg = np.cumsum(self.ideal_gains * _discount(max_rel), axis=1)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "Qrel index with %d queries and %d judgements." % (len(self.queries), len(self.judgements))
+
+    def get_query_rows(self, queries):
+        """
+            Returns the row of each query in the arrays of this index, or -1 for queries that are not in the qrel.
+        """
+        queries = np.asarray(queries)
+        rows = np.searchsorted(self.queries, queries)
+        found = rows < len(self.queries)
+        found[found] = self.queries[rows[found]] == queries[found]
+        return np.where(found, rows, -1)
+
+    def get_judgements(self, queries, docids):
+        """
+            Vectorized lookup of the relevance labels of many (query, docid) pairs.
+            Returns a float array, with NaN for unjudged pairs.
+        """
+        positions = self.judgements.get_indexer(_judgement_keys(queries, docids))
+        return np.where(positions >= 0, self.rels[positions], np.nan)
+
+    def update_judgements(self, queries, docids, rels):
+        """
+            Updates this index in place after the documents (queries[i], docids[i]) got the relevance label rels[i]
+            (new or changed judgements, each pair given once). Only the counts and the ideal gains of the queries of
+            these judgements are computed again. Queries that were not in the qrel are added.
+        """
+        queries, rels = np.asarray(queries), np.asarray(rels, dtype=float)
+        keys = _judgement_keys(queries, docids)
+        positions = self.judgements.get_indexer(keys)
+        found = positions >= 0
+        old_rels = np.where(found, self.rels[positions], np.nan)
+        self.rels[positions[found]] = rels[found]
+        if not found.all():
+            self.judgements = self.judgements.append(pd.Index(keys[~found]))
+            self.rels = np.concatenate((self.rels, rels[~found]))
+
+        # Rows of the new queries are inserted, keeping the queries sorted
+        new_queries = np.setdiff1d(queries, self.queries)
+        if len(new_queries) > 0:
+            all_queries = np.union1d(self.queries, new_queries)
+            old_rows = np.searchsorted(all_queries, self.queries)
+            ideal_gains = np.zeros((len(all_queries), self.ideal_gains.shape[1]))
+            ideal_gains[old_rows] = self.ideal_gains
+            ideal_dcg = np.zeros((len(all_queries), self.ideal_dcg.shape[1]))
+            ideal_dcg[old_rows] = self.ideal_dcg
+            self.queries, self.ideal_gains, self.ideal_dcg = all_queries, ideal_gains, ideal_dcg
+
+        # The counts are new series, as they are shared with the relevance matrices built from this index
+        query_index = pd.Index(self.queries, name="query")
+        old_relevant = self.relevant_per_query.reindex(query_index, fill_value=0)
+        changes = pd.DataFrame({"rel": (rels > 0).astype(int) - (old_rels > 0).astype(int),
+                                "nrel": (rels <= 0).astype(int) - (old_rels <= 0).astype(int)}).groupby(queries).sum()
+        self.relevant_per_query = old_relevant.add(changes["rel"], fill_value=0).reindex(query_index).astype(int)
+        self.nonrelevant_per_query = self.nonrelevant_per_query.add(changes["nrel"], fill_value=0)\
+                                         .reindex(query_index, fill_value=0).astype(int)
+
+        max_rel = self.relevant_per_query.max() if len(self.queries) > 0 else 0
+        if max_rel > self.ideal_gains.shape[1]:
+            self.ideal_gains = _widen(self.ideal_gains, max_rel)
+            self.ideal_dcg = _widen(self.ideal_dcg, max_rel, repeat_last=True)
+
+        # Ideal gains of the changed queries: labels of the old relevant documents out, labels of the new ones in
+        changed = (rels > 0) | (old_rels > 0)
+        rows = np.searchsorted(self.queries, queries)
+        for row in np.unique(rows[changed]):
+            in_row = changed & (rows == row)
+            gains = list(self.ideal_gains[row, :old_relevant.iloc[row]])
+            for rel in old_rels[in_row][old_rels[in_row] > 0]:
+                gains.remove(rel)
+            gains = sorted(gains + list(rels[in_row][rels[in_row] > 0]), reverse=True)
+            self.ideal_gains[row] = 0.0
+            self.ideal_gains[row, :len(gains)] = gains
+            self.ideal_dcg[row] = np.cumsum(self.ideal_gains[row] * _discount(self.ideal_gains.shape[1]))
+
+
+class TrecRelevanceMatrix:
+
+    def __init__(self, run, qrels, depth=None, trec_eval=True):
+        """
+            TrecRelevanceMatrix holds a run joined with a qrel as dense NumPy arrays.
+            Each row is a query of the run and each column a rank position, so that the evaluation metrics
+            become vectorized reductions over the rows. Build it once and reuse it for all metrics and cutoffs.
+
+            Params
+            -------
+            run: an object of type TrecRun
+            qrels: an object of type TrecQrel, or a TrecQrelIndex to share the qrel side among many runs
+            depth: keep only the first 'depth' documents of each query. Default = None (keep all documents)
+            trec_eval: set to True to sort documents as trec_eval does, i.e., by score and then by docid (both descending).
+                       If False, the order of the run is kept. Default = True
+
+            Attributes
+            --------
+            queries: array (Q) with the queries of the run, sorted
+            docnos: array with all document names. doc_codes index this array
+            doc_codes: int matrix (Q x D) with the documents retrieved, -1 where nothing was retrieved
+            scores: float matrix (Q x D) with the scores of the documents, NaN where nothing was retrieved
+            rels: float matrix (Q x D) with the relevance label of each document, NaN where it is unjudged
+            retrieved: boolean matrix (Q x D), True where a document was retrieved
+            judged: boolean matrix (Q x D), True where a retrieved document is judged
+            gains: float matrix (Q x D) with the relevance label of the relevant documents and 0 elsewhere
+            ideal_gains: float matrix (Q x R) with the relevance labels of all relevant documents, sorted descending
+            ideal_dcg: float matrix (Q x R) with the DCG of the ideal ranking at each cutoff (linear gains)
+            n_rel: array (Q) with the number of relevant documents of each query
+            n_nrel: array (Q) with the number of judged non-relevant documents of each query
+            relevant_per_query: pandas series with the number of relevant documents for all queries in the qrels
+        """
+        index = qrels if isinstance(qrels, TrecQrelIndex) else TrecQrelIndex(qrels)
+        run_data = run.run_data
+
+        query_codes, self.queries = pd.factorize(run_data["query"], sort=True)
+        doc_codes, self.docnos = pd.factorize(run_data["docid"], sort=True)
+        self.queries = np.asarray(self.queries)
+        self.docnos = np.asarray(self.docnos)
+        # Position of each document in its query, in the original order of the run
+        positions = pd.Series(query_codes).groupby(query_codes).cumcount().values
+
+        nqueries = len(self.queries)
+        ndocs = positions.max() + 1 if positions.shape[0] > 0 else 0
+        self.doc_codes = np.full((nqueries, ndocs), -1, dtype=np.int64)
+        self.doc_codes[query_codes, positions] = doc_codes
+        self.scores = np.full((nqueries, ndocs), np.nan)
+        self.scores[query_codes, positions] = run_data["score"].values
+        self.rels = np.full((nqueries, ndocs), np.nan)
+        self.rels[query_codes, positions] = index.get_judgements(run_data["query"].values, run_data["docid"].values)
+
+        self.__set_qrels(index)
+
+        self.trec_eval = False
+        if trec_eval:
+            self.sort_by_score(inplace=True)
+        if depth is not None:
+            self.__cut(depth)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "Relevance matrix with %d queries and up to %d documents per query." % self.scores.shape
+
+    @property
+    def retrieved(self):
+        return self.doc_codes >= 0
+
+    @property
+    def judged(self):
+        return ~np.isnan(self.rels)
+
+    @property
+    def relevant(self):
+        return self.rels > 0
+
+    @property
+    def gains(self):
+        return np.where(self.relevant, self.rels, 0.0)
+
+    def __set_qrels(self, index):
+        """
+            Takes the qrel side of the matrix (number of relevant documents and ideal gains per query) from a TrecQrelIndex.
+        """
+        nqueries = len(self.queries)
+        rows = index.get_query_rows(self.queries)
+        in_qrels = rows >= 0
+        self.relevant_per_query = index.relevant_per_query
+        self.n_rel = self.relevant_per_query.reindex(self.queries, fill_value=0).values
+        self.n_nrel = index.nonrelevant_per_query.reindex(self.queries, fill_value=0).values
+        self.ideal_gains = np.zeros((nqueries, index.ideal_gains.shape[1]))
+        self.ideal_gains[in_qrels] = index.ideal_gains[rows[in_qrels]]
+        self.ideal_dcg = np.zeros((nqueries, index.ideal_dcg.shape[1]))
+        self.ideal_dcg[in_qrels] = index.ideal_dcg[rows[in_qrels]]
+
+    def remove_judgements(self, qrels, queries, docids):
+        """
+            Returns a new TrecRelevanceMatrix of the same run for a qrel made by removing the judgements of the
+            documents (queries[i], docids[i]) from the current one, without merging the run with the qrels again.
+            The removed documents become unjudged. All other relevance labels are kept.
+
+            Params
+            -------
+            qrels: the reduced qrel, as a TrecQrel or a TrecQrelIndex. It gives the new number of relevant documents
+                   and ideal gains of each query.
+            queries, docids: arrays with the removed judgements
+        """
+        index = qrels if isinstance(qrels, TrecQrelIndex) else TrecQrelIndex(qrels)
+        matrix = self.__copy()
+        matrix.__set_qrels(index)
+
+        rows, cols, _ = self.__find_cells(queries, docids)
+        matrix.rels = self.rels.copy()
+        matrix.rels[rows, cols] = np.nan
+        return matrix
+
+    def update_judgements(self, qrels, queries, docids, rels):
+        """
+            Updates this TrecRelevanceMatrix in place after the documents (queries[i], docids[i]) got the relevance
+            label rels[i] (new or changed judgements). Only the positions of these documents and the number of
+            relevant documents and ideal gains of their queries are updated, the run is not merged with the qrels again.
+
+            Params
+            -------
+            qrels: the updated qrel, as a TrecQrel or a TrecQrelIndex (see TrecQrelIndex.update_judgements)
+            queries, docids, rels: arrays with the new judgements
+
+            Returns
+            --------
+            The rows of the queries of the run that got new judgements
+        """
+        index = qrels if isinstance(qrels, TrecQrelIndex) else TrecQrelIndex(qrels)
+        rows = np.flatnonzero(np.isin(self.queries, np.unique(queries)))
+        index_rows = index.get_query_rows(self.queries[rows])
+
+        # The qrel side is shared with the copies of this matrix (e.g., the sorted one), so new arrays are made
+        self.relevant_per_query = index.relevant_per_query
+        self.n_rel, self.n_nrel = self.n_rel.copy(), self.n_nrel.copy()
+        self.n_rel[rows] = index.relevant_per_query.reindex(self.queries[rows], fill_value=0).values
+        self.n_nrel[rows] = index.nonrelevant_per_query.reindex(self.queries[rows], fill_value=0).values
+
+        width = max(self.ideal_gains.shape[1], index.ideal_gains.shape[1])
+        self.ideal_gains = _widen(self.ideal_gains, width)
+        self.ideal_dcg = _widen(self.ideal_dcg, width, repeat_last=True)
+        in_qrels = index_rows >= 0
+        self.ideal_gains[rows] = 0.0
+        self.ideal_gains[rows[in_qrels]] = _widen(index.ideal_gains[index_rows[in_qrels]], width)
+        self.ideal_dcg[rows] = 0.0
+        self.ideal_dcg[rows[in_qrels]] = _widen(index.ideal_dcg[index_rows[in_qrels]], width, repeat_last=True)
+
+        cell_rows, cols, pairs = self.__find_cells(queries, docids)
+        self.rels = self.rels.copy()
+        self.rels[cell_rows, cols] = np.asarray(rels, dtype=float)[pairs]
+        return rows
+
+    def select_rows(self, rows):
+        """
+            Returns a new TrecRelevanceMatrix with only the queries in the given rows, e.g., to compute again the
+            metrics of a few queries after update_judgements.
+        """
+        matrix = self.__copy()
+        matrix.queries = self.queries[rows]
+        for attribute in ["doc_codes", "scores", "rels", "n_rel", "n_nrel", "ideal_gains", "ideal_dcg"]:
+            setattr(matrix, attribute, getattr(self, attribute)[rows])
+        return matrix
+
+    def __find_cells(self, queries, docids):
+        """
+            Returns the rows and cols of the retrieved documents among the pairs (queries[i], docids[i]),
+            and the pair i of each of them.
+        """
+        queries, docids = np.asarray(queries), np.asarray(docids)
+        rows = np.searchsorted(self.queries, queries)
+        codes = np.searchsorted(self.docnos, docids)
+        found = (rows < len(self.queries)) & (codes < len(self.docnos))
+        found[found] = (self.queries[rows[found]] == queries[found]) & (self.docnos[codes[found]] == docids[found])
+
+        # Pairs and retrieved documents are both encoded as row * len(docnos) + doc_code. Only the rows of the
+        # pairs are searched. If a pair is given more than once, the last one is used.
+        pair_cells = pd.Index(rows[found] * len(self.docnos) + codes[found])
+        last = ~pair_cells.duplicated(keep="last")
+        pair_cells, pairs = pair_cells[last], np.flatnonzero(found)[last]
+        search_rows = np.unique(rows[found])
+        cells = search_rows[:, np.newaxis] * len(self.docnos) + self.doc_codes[search_rows]
+        positions = np.where(self.doc_codes[search_rows] >= 0, pair_cells.get_indexer(cells.ravel()).reshape(cells.shape), -1)
+
+        matched_rows, cols = np.nonzero(positions >= 0)
+        return search_rows[matched_rows], cols, pairs[positions[matched_rows, cols]]
+
+    def __cut(self, depth):
+        self.doc_codes = self.doc_codes[:, :depth]
+        self.scores = self.scores[:, :depth]
+        self.rels = self.rels[:, :depth]
+
+    def sort_by_score(self, inplace=False):
+        """
+            Sorts the documents of each query as trec_eval does: by score and then by docid, both descending.
+
+            Returns
+            --------
+            A sorted TrecRelevanceMatrix (or None if inplace=True)
+        """
+        matrix = self if inplace else self.__copy()
+
+        # np.lexsort uses the last key as the primary one. Empty positions go to the end of each row.
+        scores = np.where(matrix.retrieved, -matrix.scores, np.inf)
+        order = np.lexsort((-matrix.doc_codes, scores), axis=1)
+        matrix.doc_codes = np.take_along_axis(matrix.doc_codes, order, axis=1)
+        matrix.scores = np.take_along_axis(matrix.scores, order, axis=1)
+        matrix.rels = np.take_along_axis(matrix.rels, order, axis=1)
+        matrix.trec_eval = True
+
+        if not inplace:
+            return matrix
+
+    def __copy(self):
+        matrix = TrecRelevanceMatrix.__new__(TrecRelevanceMatrix)
+        matrix.__dict__.update(self.__dict__)
+        return matrix
+
+    def __per_query(self, values, label):
+        return pd.Series(values, index=pd.Index(self.queries, name="query"), name=label)
+
+    def __per_depth(self, label, func, depth, depths):
+        """
+            Applies func(depth) -> values per query for a single depth (returns a pandas series)
+            or for a list of depths (returns a pandas dataframe with one col per depth).
+        """
+        if depths is None:
+            return self.__per_query(func(depth), label % (depth))
+        return pd.DataFrame(dict((label % (d), func(d)) for d in depths),
+                            index=pd.Index(self.queries, name="query"))
+
+    @staticmethod
+    def __value_at(prefix_sums, depth):
+        """
+            Returns the value of each row of a cumulative sum matrix at the position 'depth' (starting by 1).
+        """
+        if prefix_sums.shape[1] == 0:
+            return np.zeros(prefix_sums.shape[0])
+        return prefix_sums[:, min(depth, prefix_sums.shape[1]) - 1]
+
+    def __cutoff(self, depth):
+        return min(depth, self.scores.shape[1])
+
+    def remove_unjudged(self):
+        """
+            Returns a new TrecRelevanceMatrix without the unjudged documents.
+            The judged documents move up, keeping their relative order.
+        """
+        matrix = self.__copy()
+        judged = self.judged
+        order = np.argsort(~judged, axis=1, kind="stable")
+        matrix.doc_codes = np.where(judged, self.doc_codes, -1)
+        matrix.scores = np.where(judged, self.scores, np.nan)
+        matrix.doc_codes = np.take_along_axis(matrix.doc_codes, order, axis=1)
+        matrix.scores = np.take_along_axis(matrix.scores, order, axis=1)
+        matrix.rels = np.take_along_axis(self.rels, order, axis=1)
+        return matrix
+
+    def get_retrieved_documents(self):
+        """
+            Returns a pandas series with the number of retrieved documents per query.
+        """
+        return self.__per_query(self.retrieved.sum(axis=1), "num_ret")
+
+    def get_relevant_retrieved_documents(self, depth=None):
+        """
+            Returns a pandas series with the number of relevant documents among the top 'depth' ones (default: all documents).
+        """
+        relevant = self.relevant[:, :depth]
+        return self.__per_query(relevant.sum(axis=1), "num_rel_ret")
+
+    def get_precision(self, depth=1000, depths=None):
+        """
+            Returns a pandas series with the binary precision at depth d (P@d) per query.
+            If a list of depths is given, returns a pandas dataframe with one col per depth (P@d1, P@d2, ...),
+            all of them computed from the same cumulative sum.
+        """
+        max_depth = depth if depths is None else max(depths)
+        relevant_so_far = np.cumsum(self.relevant[:, :self.__cutoff(max_depth)], axis=1)
+        return self.__per_depth("P@%d", lambda d: self.__value_at(relevant_so_far, d) / d, depth, depths)
+
+    def get_recall(self, depth=1000, depths=None):
+        """
+            Returns a pandas series with the recall at depth d (Recall@d) per query, i.e., the fraction of the relevant
+            documents found among the top d ones. Queries without relevant documents get a NaN.
+            If a list of depths is given, returns a pandas dataframe with one col per depth.
+        """
+        max_depth = depth if depths is None else max(depths)
+        relevant_so_far = np.cumsum(self.relevant[:, :self.__cutoff(max_depth)], axis=1)
+
+        def recall(d):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(self.n_rel > 0, self.__value_at(relevant_so_far, d) / self.n_rel, np.nan)
+
+        return self.__per_depth("Recall@%d", recall, depth, depths)
+
+    def get_ndcg(self, depth=1000, trec_eval=True, depths=None):
+        """
+            Returns a pandas series with the normalized discounted cumulative gain (NDCG@d) per query.
+            trec_eval: If True, the gain of a document is its relevance label, as in trec_eval. Otherwise, it is 2^rel - 1.
+            As in TrecEval.get_ndcg, queries without relevant documents among the top 'depth' ones get a NaN.
+            If a list of depths is given, returns a pandas dataframe with one col per depth.
+        """
+        max_depth = depth if depths is None else max(depths)
+        gains = self.gains[:, :self.__cutoff(max_depth)]
+        ideal_gains = self.ideal_gains[:, :max_depth]
+        found = np.cumsum(gains > 0, axis=1)
+        if not trec_eval:
+            gains = 2 ** gains - 1.0
+            ideal_gains = 2 ** ideal_gains - 1.0
+
+        dcg = np.cumsum(gains * _discount(gains.shape[1]), axis=1)
+        if trec_eval:
+            idcg = self.ideal_dcg
+        else:
+            idcg = np.cumsum(ideal_gains * _discount(ideal_gains.shape[1]), axis=1)
+
+        def ndcg(d):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(self.__value_at(found, d) > 0, self.__value_at(dcg, d) / self.__value_at(idcg, d), np.nan)
+
+        return self.__per_depth("NDCG@%d", ndcg, depth, depths)
+
+    def get_map(self, depth=1000):
+        """
+            Returns a pandas series with the average precision (AP@d) per query.
+            Queries without relevant documents get a NaN.
+        """
+        relevant = self.relevant[:, :self.__cutoff(depth)]
+        ranks = np.arange(1, relevant.shape[1] + 1)
+        precision_at_rank = np.cumsum(relevant, axis=1) / ranks
+        ap = (precision_at_rank * relevant).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ap = np.where(self.n_rel > 0, ap / np.minimum(self.n_rel, depth), np.nan)
+        return self.__per_query(ap, "MAP@%d" % (depth))
+
+    def get_rprec(self, depth=1000):
+        """
+            Returns a pandas series with the precision at R per query, where R is the number of relevant documents.
+            As in TrecEval.get_rprec, queries without relevant documents among the top R ones get a NaN.
+        """
+        relevant = self.relevant[:, :self.__cutoff(depth)]
+        relevant_so_far = np.cumsum(relevant, axis=1)
+        cutoff = np.minimum(self.n_rel, relevant.shape[1])
+        hits = np.where(cutoff > 0, relevant_so_far[np.arange(relevant.shape[0]), np.maximum(cutoff - 1, 0)], 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rprec = np.where(hits > 0, hits / self.n_rel, np.nan)
+        return self.__per_query(rprec, "RPrec@%d" % (depth))
+
+    def get_reciprocal_rank(self, depth=1000):
+        """
+            Returns a pandas series with the reciprocal rank of the first relevant document per query.
+            As in TrecEval.get_reciprocal_rank, queries without relevant documents among the top 'depth' ones get a NaN.
+        """
+        relevant = self.relevant[:, :self.__cutoff(depth)]
+        first = np.argmax(relevant, axis=1) + 1
+        recip_rank = np.where(relevant.any(axis=1), 1.0 / first, np.nan)
+        return self.__per_query(recip_rank, "recip_rank@%d" % (depth))
+
+    def get_bpref(self, depth=1000):
+        """
+            Returns a pandas series with the binary preference (BPREF) per query.
+            As in TrecEval.get_bpref, only the first 'depth' judged documents are taken into account and
+            queries without relevant documents among them get a NaN.
+        """
+        relevant = self.relevant
+        nrel_so_far = np.cumsum(self.rels == 0, axis=1)
+        in_depth = np.cumsum(self.judged, axis=1) <= depth
+
+        n_rel = self.n_rel[:, np.newaxis]
+        denominator = np.minimum(self.n_rel, self.n_nrel)[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = (1.0 - np.minimum(nrel_so_far, n_rel) / denominator) / n_rel
+            bpref = np.nansum(np.where(relevant & in_depth, values, 0.0), axis=1)
+        bpref = np.where((relevant & in_depth).any(axis=1), bpref, np.nan)
+        return self.__per_query(bpref, "Bpref@%d" % (depth))
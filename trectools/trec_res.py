@@ -40,7 +40,7 @@ class TrecRes:
             print("ERROR: the header of your file should have size 3, but I just read %d colunms." % (len(result_header)))
 
         self.filename = filename
-        self.data = pd.read_csv(filename, sep="\s+", names=result_header)
+        self.data = pd.read_csv(filename, sep=r"\s+", names=result_header)
         self.runid = "Anyone"
 
         if double_values:
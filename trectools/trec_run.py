@@ -13,11 +13,16 @@ import pandas as pd
 import numpy as np
 
 from trectools import TrecRes
+from trectools import trec_cache
 
 '''
 '''
 class TrecRun(object):
     def __init__(self, filename=None):
+        # Lazily built map topic -> row positions, see get_top_documents
+        self.__topic_index = None
+        self.__topic_index_data = None
+
         if filename is not None:
             self.read_run(filename)
         else:
@@ -34,35 +39,59 @@ class TrecRun(object):
             return "Data file not set yet"
 
     def get_runid(self):
-        return self.run_data["system"][0]
+        return self.run_data["system"].iloc[0]
 
     def rename_runid(self, name):
         self.run_data["system"] = name
+        self.__reset_topic_index()
+
+    def __reset_topic_index(self):
+        self.__topic_index = None
+        self.__topic_index_data = None
 
-    def read_run(self, filename, run_header=None):
+    def __get_topic_index(self):
+        """
+            Returns a dict {topic: positions of its rows in run_data}, built once and reused until run_data changes.
+        """
+        if self.__topic_index is None or self.__topic_index_data is not self.run_data:
+            self.__topic_index = self.run_data.groupby("query", sort=False, observed=True).indices
+            self.__topic_index_data = self.run_data
+        return self.__topic_index
+
+    def read_run(self, filename, run_header=None, fast=False, categorical=False, cache=False):
+        """
+            Reads a run in TREC format from 'filename'.
+            With fast=True the columns are parsed directly into their final types (strings for
+            query, q0, docid and system, float for score) by pandas' C parser, skipping type
+            inference and the string conversion afterwards. Identifiers keep their textual form,
+            i.e., topic '001' is not turned into '1'.
+            With categorical=True query, q0, docid and system are stored as pandas categoricals,
+            keeping each distinct identifier only once. This implies fast=True.
+            With cache=True (or the path of a cache directory) the parsed run is stored in a binary
+            sidecar file and later reads of the unchanged file load it from there.
+        """
         # Replace with default argument for run_header
         if run_header is None:
             run_header = ["query", "q0", "docid", "rank", "score", "system"]
 
         # Set filename
         self.filename = filename
+        self.__reset_topic_index()
 
-        # Read data from file
-        self.run_data = pd.read_csv(filename, sep="\s+", names=run_header)
+        if cache:
+            options = ("run", list(run_header), bool(fast or categorical), bool(categorical))
+            self.run_data = trec_cache.load_cached_frame(filename, options, cache)
+            if self.run_data is not None:
+                return
 
-        # Enforce string type on docid column (if present)
-        if "docid" in self.run_data:
-            self.run_data["docid"] = self.run_data["docid"].astype(str)
-        # Enforce string type on q0 column (if present)
-        if "q0" in self.run_data:
-            self.run_data["q0"] = self.run_data["q0"].astype(str)
-        # Enforce string type on query column (if present)
-        if "query" in self.run_data:
-            self.run_data["query"] = self.run_data["query"].astype(str)
+        self.run_data = _read_run_table(filename, run_header, fast=fast, categorical=categorical)
 
         # Make sure the values are correctly sorted by score
         self.run_data.sort_values(["query", "score", "docid"], inplace=True, ascending=[True, False, True])
 
+        if cache:
+            trec_cache.store_cached_frame(filename, options, self.run_data, cache)
+
     def load_run_from_dataframe(self, df, column_mapping=None, validate=True):
         # Apply column mapping if specified
         if column_mapping is not None:
@@ -76,6 +105,7 @@ class TrecRun(object):
                 raise ValueError(f"Required column(s) {missing} not present in supplied dataframe")
 
         self.run_data = df.copy()
+        self.__reset_topic_index()
         ## Enforce string type on docid column (if present)
         if "docid" in self.run_data:
             self.run_data["docid"] = self.run_data["docid"].astype(str)
@@ -114,12 +144,15 @@ class TrecRun(object):
         """
             Returns the top 'n' documents for a given 'topic'.
         """
-        return list(self.run_data[self.run_data['query'] == topic]["docid"].head(n))
+        positions = self.__get_topic_index().get(topic)
+        if positions is None:
+            return []
+        return list(self.run_data["docid"].values[positions[:n]])
 
-    def evaluate_run(self, trec_qrel_obj, per_query):
+    def evaluate_run(self, trec_qrel_obj, per_query, engine="pandas", qrels_index=None):
         from trectools import TrecEval
-        evaluator = TrecEval(self, trec_qrel_obj)
-        result = evaluator.evaluate_all(per_query)
+        evaluator = TrecEval(self, trec_qrel_obj, qrels_index=qrels_index)
+        result = evaluator.evaluate_all(per_query, engine=engine)
         return result
 
     def check_qrel_coverage(self, trecqrel, topX=10):
@@ -149,8 +182,8 @@ class TrecRun(object):
         """
             Check the intersection of two runs for the topX documents.
         """
-        runA = self.run_data[["query", "docid"]].groupby("query")[["query", "docid"]].head(topX)
-        runB = another_run.run_data[["query", "docid"]].groupby("query")[["query", "docid"]].head(topX)
+        runA = self.run_data[["query", "docid"]].groupby("query", observed=True)[["query", "docid"]].head(topX)
+        runB = another_run.run_data[["query", "docid"]].groupby("query", observed=True)[["query", "docid"]].head(topX)
 
         common_topics = set(runA["query"].unique()).intersection(runB["query"].unique())
 
@@ -172,3 +205,197 @@ class TrecRun(object):
         df_slice = self.run_data[self.run_data["query"].apply(lambda x: x in set(topics))]
         df_slice.sort_values(by=["query", "score"], ascending=[True, False]).to_csv(filename, sep=" ", header=False, index=False)
         print("File %s writen." % filename)
+
+
+def _read_run_table(filename, run_header, fast=False, categorical=False, chunksize=None):
+    """
+        Parses a run file as read_run does, without sorting it.
+        Returns a DataFrame, or an iterator of DataFrames with 'chunksize' rows each if 'chunksize' is set.
+    """
+    if fast or categorical:
+        # Read data from file with explicit types
+        text_type = "category" if categorical else str
+        dtypes = {column: text_type for column in ["query", "q0", "docid", "system"] if column in run_header}
+        if "score" in run_header:
+            dtypes["score"] = np.float64
+        return pd.read_csv(filename, sep=r"\s+", names=run_header, dtype=dtypes, engine="c", chunksize=chunksize)
+
+    # Read data from file
+    data = pd.read_csv(filename, sep=r"\s+", names=run_header, chunksize=chunksize)
+    if chunksize is None:
+        return _enforce_string_columns(data)
+    return (_enforce_string_columns(chunk) for chunk in data)
+
+
+def _enforce_string_columns(df):
+    # Enforce string type on docid column (if present)
+    if "docid" in df:
+        df["docid"] = df["docid"].astype(str)
+    # Enforce string type on q0 column (if present)
+    if "q0" in df:
+        df["q0"] = df["q0"].astype(str)
+    # Enforce string type on query column (if present)
+    if "query" in df:
+        df["query"] = df["query"].astype(str)
+    return df
+
+
+def _make_topic_run(filename, blocks, seen_topics):
+    run = TrecRun()
+    run.filename = filename
+    run.run_data = pd.concat(blocks) if len(blocks) > 1 else blocks[0]
+
+    topic = run.run_data["query"].iloc[0]
+    if topic in seen_topics:
+        raise ValueError("Run %s is not sorted by topic: topic %s appears in more than one block." % (filename, topic))
+    seen_topics.add(topic)
+
+    # Make sure the values are correctly sorted by score
+    run.run_data = run.run_data.sort_values(["query", "score", "docid"], ascending=[True, False, True])
+    return run
+
+
+def read_run_by_topic(filename, run_header=None, fast=False, chunksize=100000):
+    """
+        Reads a run file whose lines are grouped by topic (as trec_eval expects them) one topic at a time.
+        Yields one TrecRun per topic, in the order of the file, each sorted as by TrecRun.read_run.
+        Only 'chunksize' lines plus the current topic are held in memory, so runs larger than the
+        available memory can be processed topic by topic.
+
+        Raises a ValueError if a topic shows up again after another topic started.
+    """
+    # Replace with default argument for run_header
+    if run_header is None:
+        run_header = ["query", "q0", "docid", "rank", "score", "system"]
+
+    seen_topics = set([])
+    blocks = []
+    current_topic = None
+    for chunk in _read_run_table(filename, run_header, fast=fast, chunksize=chunksize):
+        queries = chunk["query"].values
+        bounds = [0] + list(np.flatnonzero(queries[1:] != queries[:-1]) + 1) + [len(queries)]
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            if len(blocks) > 0 and queries[begin] != current_topic:
+                yield _make_topic_run(filename, blocks, seen_topics)
+                blocks = []
+            current_topic = queries[begin]
+            blocks.append(chunk.iloc[begin:end])
+
+    if len(blocks) > 0:
+        yield _make_topic_run(filename, blocks, seen_topics)
+
+
+def natural_topic_key(topic):
+    """
+        Orders numeric topics by their value (2 before 10) and places the other topics after them.
+    """
+    topic = str(topic)
+    if topic.isdigit():
+        return (0, int(topic), topic)
+    return (1, 0, topic)
+
+
+def string_topic_key(topic):
+    """
+        Orders topics as strings (10 before 2), as TrecRun.read_run sorts them and print_subset writes them.
+    """
+    return str(topic)
+
+
+class _TopicStream(object):
+    """
+        A stream of per topic runs that can look ahead at its next runs.
+    """
+    def __init__(self, stream):
+        self.iterator = iter(stream)
+        self.buffer = []
+
+    def peek(self, position=0):
+        """
+            Returns the topic of the run 'position' steps ahead, or None if the stream ends before it.
+        """
+        while len(self.buffer) <= position:
+            run = next(self.iterator, None)
+            if run is None:
+                return None
+            self.buffer.append(run)
+        return self.buffer[position].run_data["query"].iloc[0]
+
+    def pop(self):
+        self.peek()
+        return self.buffer.pop(0)
+
+
+def _check_topic_order(keys, topic, next_topic, stream):
+    """
+        Returns the keys that place next_topic after topic. Raises a ValueError if there is none.
+    """
+    keys = [key for key in keys if key(topic) < key(next_topic)]
+    if len(keys) == 0:
+        raise ValueError("Topic %s comes after topic %s in stream %d. All streams must be sorted by topic." %
+                         (next_topic, topic, stream))
+    return keys
+
+
+def _find_topic_order(streams, keys):
+    """
+        Looks ahead in all streams at the same time until the topics of one of them follow only one of the keys.
+        If the streams end before that, their topics fit all keys and the first one is used.
+    """
+    position = 0
+    while len(keys) > 1:
+        found_pair = False
+        for i, stream in enumerate(streams):
+            next_topic = stream.peek(position + 1)
+            if next_topic is not None:
+                found_pair = True
+                keys = _check_topic_order(keys, stream.peek(position), next_topic, i)
+        if not found_pair:
+            break
+        position += 1
+    return keys[:1]
+
+
+def align_topics(topic_streams, key=None):
+    """
+        Walks through several streams of per topic runs (e.g., created with read_run_by_topic) at the same time.
+        All streams have to list their topics in the same order, given by 'key'. By default (key=None) this can be
+        the order of the topics as strings (string_topic_key), which is how TrecRun sorts and writes runs, or the
+        order of numeric topics by value (natural_topic_key). Both orders agree unless numeric topics of different
+        widths (e.g., 2 and 10) are compared. Only then the streams are read ahead until their topics show which
+        order they follow, keeping the runs read ahead in memory.
+
+        Yields (topic, list of TrecRun) pairs, with one TrecRun per stream. Streams missing a topic
+        contribute an empty TrecRun.
+    """
+    keys = [string_topic_key, natural_topic_key] if key is None else [key]
+    streams = [_TopicStream(stream) for stream in topic_streams]
+
+    while True:
+        topics = [stream.peek() for stream in streams]
+        if all(topic is None for topic in topics):
+            break
+        present = [topic for topic in topics if topic is not None]
+        if len(keys) > 1 and len(set(min(present, key=k) for k in keys)) > 1:
+            keys = _find_topic_order(streams, keys)
+        next_topic = min(present, key=keys[0])
+
+        runs = []
+        for i, (stream, topic) in enumerate(zip(streams, topics)):
+            if topic is None or keys[0](topic) != keys[0](next_topic):
+                runs.append(_make_empty_run())
+                continue
+            runs.append(stream.pop())
+            if stream.peek() is not None:
+                keys = _check_topic_order(keys, topic, stream.peek(), i)
+
+        yield next_topic, runs
+
+
+def _make_empty_run():
+    run = TrecRun()
+    # Typed columns, so that concatenating it with other runs keeps their dtypes
+    run.load_run_from_dataframe(pd.DataFrame({"query": pd.Series(dtype=object), "q0": pd.Series(dtype=object),
+                                              "docid": pd.Series(dtype=object), "rank": pd.Series(dtype=np.int64),
+                                              "score": pd.Series(dtype=np.float64), "system": pd.Series(dtype=object)}))
+    return run
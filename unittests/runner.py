@@ -1,7 +1,7 @@
 import unittest
 
 # import your test modules
-import testtrecrun, testtreceval
+import testtrecrun, testtrecqrel, testtreceval, testfusion, testtrecpool
 
 # initialize the test suite
 loader = unittest.TestLoader()
@@ -9,7 +9,10 @@ suite  = unittest.TestSuite()
 
 # add tests to the test suite
 suite.addTests(loader.loadTestsFromModule(testtrecrun))
+suite.addTests(loader.loadTestsFromModule(testtrecqrel))
 suite.addTests(loader.loadTestsFromModule(testtreceval))
+suite.addTests(loader.loadTestsFromModule(testfusion))
+suite.addTests(loader.loadTestsFromModule(testtrecpool))
 
 # initialize a runner, pass it your suite and run it
 runner = unittest.TextTestRunner(verbosity=3)
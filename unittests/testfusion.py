@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import pandas as pd
+from trectools import TrecRun, TrecQrel, TrecEval, fusion
+from trectools.trec_run import natural_topic_key
+
+
+class TestFusion(unittest.TestCase):
+
+    def setUp(self):
+        self.run1 = TrecRun("./files/r1.run")
+        self.run2 = TrecRun("./files/r2.run")
+        self.run3 = TrecRun("./files/r3.run")
+
+    def tearDown(self):
+        pass
+
+    def test_combos(self):
+        fused = fusion.combos([self.run1, self.run2], strategy="sum")
+        self.assertListEqual(fused.get_top_documents("1"), ["doc1_1", "doc1_2", "doc1_3"])
+        self.assertListEqual(list(fused.run_data["score"].head(3)), [2.0, 1.62, 1.60])
+        self.assertListEqual(list(fused.run_data["rank"].head(3)), [1, 2, 3])
+
+        # Every run counts, not only the last two
+        runs = [self.run1, self.run2, self.run3]
+        fused = fusion.combos(runs, strategy="sum")
+        for topic in ["1", "2", "3"]:
+            for docid, score in fused.run_data[fused.run_data["query"] == topic][["docid", "score"]].values:
+                expected = sum(r.run_data[(r.run_data["query"] == topic) & (r.run_data["docid"] == docid)]["score"].sum() for r in runs)
+                self.assertAlmostEqual(score, expected)
+
+        fused = fusion.combos(runs, strategy="mnz", max_docs={"1": 1, "2": 2, "3": 1})
+        self.assertListEqual(list(fused.run_data["query"]), ["1", "2", "2", "3"])
+        self.assertAlmostEqual(fused.run_data["score"].values[0], 3.0 * 3)
+
+    def test_combos_sparse(self):
+        runs = [self.run1, self.run2, self.run3]
+        for strategy in ["sum", "max", "min", "anz", "mnz", "med"]:
+            dense = fusion.combos(runs, strategy=strategy).run_data
+            sparse = fusion.combos(runs, strategy=strategy, backend="sparse").run_data
+            self.assertListEqual(list(dense["docid"]), list(sparse["docid"]))
+            for d, s in zip(dense["score"], sparse["score"]):
+                self.assertAlmostEqual(d, s)
+
+        self.assertRaises(ValueError, fusion.combos, runs, backend="dataframe")
+
+
+    def test_normalize_runs(self):
+        run2, = fusion.normalize_runs([self.run2], method="minmax")
+        self.assertListEqual([round(v, 3) for v in run2.run_data["score"]], [1.0, 0.05, 0.0, 1.0, 0.333, 0.0])
+        self.assertListEqual(list(run2.run_data["docid"]), list(self.run2.run_data["docid"]))
+
+        run2, = fusion.normalize_runs([self.run2], method="sum")
+        self.assertAlmostEqual(run2.run_data[run2.run_data["query"] == "3"]["score"].sum(), 1.0)
+
+        run2, = fusion.normalize_runs([self.run2], method="borda")
+        self.assertListEqual(list(run2.run_data["score"]), [3, 2, 1, 3, 2, 1])
+
+        fused = fusion.combos([self.run1, self.run2], strategy="sum", normalization="zscore")
+        self.assertListEqual(fused.get_top_documents("3"), ["doc2_1", "doc2_3", "doc2_2"])
+        self.assertRaises(ValueError, fusion.normalize_runs, [self.run1], "max")
+
+    def test_weighted_fusion(self):
+        fused = fusion.weighted_fusion([self.run1, self.run2], [1.0, 0.5])
+        for score, expected in zip(fused.run_data["score"].head(3), [1.5, 1.215, 1.2]):
+            self.assertAlmostEqual(score, expected)
+        self.assertRaises(ValueError, fusion.weighted_fusion, [self.run1, self.run2], [1.0])
+
+    def test_optimize_fusion_weights(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        runs = [self.run1, self.run2, TrecRun("./files/r4.run")]
+        grid = [[1., 0., 0.], [0., 1., 0.], [0., 0., 1.], [.2, .3, .5]]
+        for metric in ["map", "ndcg"]:
+            weights, fused = fusion.optimize_fusion_weights(runs, qrels, weights=grid, metric=metric)
+            values = []
+            for w in grid:
+                teval = TrecEval(fusion.weighted_fusion(runs, w), qrels)
+                values.append(teval.get_map() if metric == "map" else teval.get_ndcg())
+            self.assertListEqual(list(weights), grid[values.index(max(values))])
+            teval = TrecEval(fused, qrels)
+            self.assertAlmostEqual(teval.get_map() if metric == "map" else teval.get_ndcg(), max(values))
+
+        weights, fused = fusion.optimize_fusion_weights(runs, qrels, n_samples=10, random_state=0)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+
+    def test_borda_count(self):
+        fused = fusion.borda_count([self.run1, self.run2, self.run3])
+        # Topic 2: run2 did not retrieve any of the 3 candidates and gives each of them (1 + 2 + 3) / 3 points
+        self.assertListEqual(fused.get_top_documents("2"), ["doc2_1", "doc2_3", "doc2_2"])
+        self.assertListEqual(list(fused.run_data[fused.run_data["query"] == "2"]["score"]), [8.0, 6.0, 4.0])
+
+    def test_condorcet_fusion(self):
+        runs = [self.run1, self.run2, self.run3]
+        fused = fusion.condorcet_fusion(runs)
+        self.assertListEqual(fused.get_top_documents("1"), ["doc1_1", "doc1_2", "doc1_3"])
+        self.assertListEqual(list(fused.run_data[fused.run_data["query"] == "1"]["score"]), [2.0, 0.0, -2.0])
+
+        parallel = fusion.condorcet_fusion(runs, n_jobs=2)
+        self.assertTrue(parallel.run_data.equals(fused.run_data))
+
+    def test_vector_space_fusion(self):
+        fused = fusion.vector_space_fusion([self.run1, self.run2, self.run3])
+        self.assertListEqual(fused.get_top_documents("2"), ["doc2_1", "doc2_3", "doc2_2"])
+        # doc2_1 is the pivot of topic 2, doc2_3 is at distance sqrt(1 + 1)
+        scores = list(fused.run_data[fused.run_data["query"] == "2"]["score"])
+        self.assertAlmostEqual(scores[0], 10.0)
+        self.assertAlmostEqual(scores[1], 1.0 / (2 ** .5 + 0.1))
+
+    def test_fuse_run_files(self):
+        handle, output = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            fusion.fuse_run_files(["./files/r1.run", "./files/r2.run", "./files/r3.run"], output,
+                                  fusion.combos, chunksize=2, strategy="sum")
+            fused = TrecRun(output)
+            expected = fusion.combos([self.run1, self.run2, self.run3], strategy="sum")
+            self.assertListEqual(list(fused.run_data["docid"]), list(expected.run_data["docid"]))
+            self.assertListEqual(list(fused.run_data["rank"]), list(expected.run_data["rank"]))
+
+            # An unknown strategy must not leave a partial file behind
+            self.assertRaises(ValueError, fusion.fuse_run_files, ["./files/r1.run", "./files/r2.run"], output,
+                              fusion.combos, strategy="unknown")
+            self.assertFalse(os.path.exists(output))
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+    def test_fuse_run_files_string_order(self):
+        # Multi-digit topics, written by TrecRun with the topics sorted as strings (10 before 2)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            runs, filenames = [], []
+            for i, topics in enumerate([["2", "9", "10"], ["2", "10"]]):
+                run = TrecRun()
+                run.load_run_from_dataframe(pd.DataFrame({"query": topics, "q0": "Q0", "docid": ["d%s_%d" % (t, i) for t in topics],
+                                                          "rank": 1, "score": 1.0, "system": "s"}))
+                filenames.append(os.path.join(tmpdir, "run%d" % (i)))
+                run.print_subset(filenames[-1], topics)
+                runs.append(TrecRun(filenames[-1]))
+            output = os.path.join(tmpdir, "fused")
+
+            fusion.fuse_run_files(filenames, output)
+            fused = TrecRun(output)
+            expected = fusion.reciprocal_rank_fusion(runs)
+            self.assertListEqual(fused.run_data[["query", "docid"]].values.tolist(),
+                                 expected.run_data[["query", "docid"]].values.tolist())
+
+            self.assertRaises(ValueError, fusion.fuse_run_files, filenames, output, key=natural_topic_key)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = fusion.reciprocal_rank_fusion([self.run1, self.run2, self.run3], k=60)
+        self.assertListEqual(fused.get_top_documents("2"), ["doc2_1", "doc2_3", "doc2_2"])
+        self.assertAlmostEqual(fused.run_data[fused.run_data["query"] == "2"]["score"].values[0], 2.0 / 61)
+        self.assertListEqual(fused.get_top_documents("3"), ["doc2_1", "doc2_3", "doc2_2"])
+        self.assertAlmostEqual(fused.run_data["score"].values[0], 3.0 / 61)
+
+        fused = fusion.reciprocal_rank_fusion([self.run1, self.run2], k=60, max_docs=1)
+        self.assertListEqual(list(fused.run_data["rank"]), [1, 1, 1])
+
+    def test_categorical_runs(self):
+        runs = []
+        for filename in ["./files/r1.run", "./files/r2.run", "./files/r3.run"]:
+            run = TrecRun()
+            run.read_run(filename, categorical=True)
+            runs.append(run)
+        qrels = TrecQrel("./files/qrel1.txt")
+
+        # A run with categorical query and docid cols has to give the same results, without pandas warnings
+        # about unobserved categories, even when it lost some of its queries
+        subset = TrecRun()
+        subset.load_run_from_dataframe(runs[0].run_data[runs[0].run_data["query"] != "3"].copy())
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", FutureWarning)
+            fused = fusion.reciprocal_rank_fusion(runs)
+            expected = fusion.reciprocal_rank_fusion([self.run1, self.run2, self.run3])
+            self.assertListEqual(fused.run_data[["query", "docid"]].values.tolist(),
+                                 expected.run_data[["query", "docid"]].values.tolist())
+
+            for engine in ["pandas", "single_pass"]:
+                for run, str_run in [(runs[0], self.run1), (fused, expected)]:
+                    result = TrecEval(run, qrels).evaluate_all(per_query=True, engine=engine)
+                    str_result = TrecEval(str_run, qrels).evaluate_all(per_query=True, engine=engine)
+                    self.assertEqual(result.data.shape, str_result.data.shape)
+                    for metric in ["map", "P_10", "NDCG_10", "bpref", "recip_rank"]:
+                        self.assertAlmostEqual(result.get_result(metric), str_result.get_result(metric))
+
+                result = TrecEval(subset, qrels).evaluate_all(per_query=True, engine=engine)
+                self.assertEqual(result.get_result("num_q"), 2)
+                self.assertListEqual(sorted(result.data[result.data["metric"] == "P_10"]["query"]), ["1", "2", "all"])
+
+    def test_rank_biased_precision_fusion(self):
+        fused = fusion.rank_biased_precision_fusion([self.run1, self.run3], p=0.5)
+        self.assertListEqual(fused.get_top_documents("1"), ["doc1_1", "doc1_2", "doc1_3"])
+        self.assertListEqual(list(fused.run_data["score"].head(3)), [1.0, 0.5, 0.25])
+        self.assertEqual(fused.get_runid(), "rank_biased_precision_fusion_p=0.500")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
-from trectools import TrecRun, TrecQrel, TrecEval
+from unittest import mock
+import numpy as np
+from trectools import TrecRun, TrecQrel, TrecEval, TrecQrelIndex, TrecRelevanceMatrix, TrecIncrementalEval, procedures
+from trectools.trec_run import read_run_by_topic
 
 
 class TestTrecEval(unittest.TestCase):
@@ -92,6 +95,179 @@ class TestTrecEval(unittest.TestCase):
         for v, c in zip(values, correct_results):
             self.assertAlmostEqual(v, c, places=4)
 
+    def test_evaluate_all_single_pass(self):
+        for teval in [self.teval1, self.teval3, self.teval5]:
+            for per_query in [False, True]:
+                expected = teval.evaluate_all(per_query=per_query).data
+                result = teval.evaluate_all(per_query=per_query, engine="single_pass").data
+                self.assertEqual(expected.shape, result.shape)
+
+                expected = expected.set_index(["metric", "query"])["value"]
+                result = result.set_index(["metric", "query"])["value"]
+                self.assertEqual(expected.pop(("runid", "all")), result.pop(("runid", "all")))
+                for key, value in expected.items():
+                    self.assertTrue(np.isclose(float(value), float(result.loc[key]), equal_nan=True), key)
+
+        self.assertRaises(ValueError, self.teval1.evaluate_all, engine="unknown")
+
+
+    def test_relevance_matrix(self):
+        matrix = self.teval3.get_relevance_matrix()
+        self.assertIs(matrix, self.teval3.get_relevance_matrix())
+        self.assertListEqual(list(matrix.queries), self.teval3.run.topics())
+
+        expected = self.teval3.get_precision(depth=10, per_query=True)["P@10"]
+        result = matrix.get_precision(depth=10)
+        for topic in self.common_topics:
+            self.assertAlmostEqual(expected.loc[topic], result.loc[topic], places=4)
+
+        expected = self.teval3.get_map(depth=30, per_query=True)["MAP@30"]
+        result = matrix.get_map(depth=30)
+        for topic in self.common_topics:
+            self.assertAlmostEqual(expected.loc[topic], result.loc[topic], places=4)
+
+        # With trec_eval=False, documents keep the order of the run file
+        matrix = self.teval1.get_relevance_matrix(trec_eval=False)
+        self.assertListEqual(list(matrix.docnos[matrix.doc_codes[1]]), ["doc2_1", "doc2_3", "doc2_2"])
+        self.assertListEqual(list(matrix.rels[1]), [1.0, 0.0, 1.0])
+
+    def test_relevance_matrix_invalidated(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        teval = TrecEval(TrecRun("./files/r4.run"), qrels, qrels_index=qrels.get_qrels_index())
+        matrix = teval.get_relevance_matrix()
+        before = teval.evaluate_all(engine="single_pass").get_results_for_metric("map")
+
+        # Replacing the qrels data drops the cached matrices and the index built for the old data
+        qrels.add_judgements([("1", "doc1_1", 1), ("2", "doc2_3", 1)])
+        self.assertIsNot(matrix, teval.get_relevance_matrix())
+        self.assertIsNone(teval.qrels_index)
+        result = teval.evaluate_all(engine="single_pass").get_results_for_metric("map")
+        expected = TrecEval(teval.run, qrels).evaluate_all(engine="single_pass").get_results_for_metric("map")
+        self.assertNotAlmostEqual(before["all"], result["all"])
+        self.assertAlmostEqual(expected["all"], result["all"])
+
+        # So does replacing the run data
+        matrix = teval.get_relevance_matrix()
+        teval.run.run_data = teval.run.run_data.head(3).copy()
+        self.assertIsNot(matrix, teval.get_relevance_matrix())
+        self.assertEqual(len(teval.get_relevance_matrix().queries), 1)
+
+    def test_multiple_depths(self):
+        depths = [5, 10, 30, 1000]
+        precisions = self.teval2.get_precision(depths=depths)
+        ndcgs = self.teval2.get_ndcg(depths=depths)
+        for d in depths:
+            self.assertAlmostEqual(precisions[d], self.teval2.get_precision(depth=d), places=4)
+            self.assertAlmostEqual(ndcgs[d], self.teval2.get_ndcg(depth=d), places=4)
+
+        results = self.teval2.get_precision(depths=depths, per_query=True)
+        self.assertListEqual(list(results.columns), ["P@5", "P@10", "P@30", "P@1000"])
+        correct_results = [0.1333, 0.0333, 0.5333]
+        for v, c in zip(results.loc[["607", "433", "375"], "P@30"].values, correct_results):
+            self.assertAlmostEqual(v, c, places=4)
+
+        # q1 has 10 relevant documents and r5.run retrieves 5 of them in its top 5
+        self.assertDictEqual(self.teval5.get_recall(depths=[1, 5, 10]), {1: 0.1, 5: 0.5, 10: 0.5})
+        self.assertAlmostEqual(self.teval5.get_recall(depth=5), 0.5)
+
+    def test_evaluate_runs_batch(self):
+        qrels_index = TrecQrelIndex(self.teval3.qrels)
+        self.assertEqual(qrels_index.get_judgements(["303", "303"], ["FBIS3-16217", "unknown"])[0], 1.0)
+        self.assertTrue(np.isnan(qrels_index.get_judgements(["303"], ["unknown"])[0]))
+
+        teval = TrecEval(self.teval3.run, self.teval3.qrels, qrels_index=qrels_index)
+        self.assertAlmostEqual(teval.get_ndcg(depths=[30])[30], self.teval3.get_ndcg(depth=30), places=4)
+
+        results = procedures.evaluate_runs_batch([self.teval1.run, self.teval5.run], self.teval1.qrels, per_query=True)
+        self.assertListEqual(list(results.columns), ["runid", "metric", "query", "value"])
+        self.assertListEqual(list(results["runid"].unique()), ["NR", "test"])
+        expected = self.teval1.evaluate_all(per_query=True).data
+        self.assertEqual(expected.shape[0] - 1, (results["runid"] == "NR").sum())
+        self.assertAlmostEqual(results.set_index(["runid", "metric", "query"]).loc[("NR", "map", "all"), "value"],
+                               0.2685, places=4)
+
+    def test_evaluate_runs_parallel(self):
+        runs = [TrecRun("./files/r1.run"), TrecRun("./files/r2.run"), self.teval1.run]
+        expected = procedures.evaluate_runs(runs, self.teval1.qrels, per_query=False)
+        results = procedures.evaluate_runs(runs, self.teval1.qrels, per_query=False, n_jobs=2, engine="single_pass")
+        self.assertEqual(len(results), 3)
+        for e, r in zip(expected, results):
+            self.assertAlmostEqual(e.get_result("map"), r.get_result("map"), places=4)
+
+        results = procedures.evaluate_runs_from_path("./files", self.teval1.qrels, suffix="r[124].run", n_jobs=2)
+        for e, r in zip(expected, results):
+            self.assertAlmostEqual(e.get_result("map"), r.get_result("map"), places=4)
+
+        # The default is to evaluate in the calling process
+        results = procedures.evaluate_runs_from_path("./files", self.teval1.qrels, suffix="r[124].run")
+        for e, r in zip(expected, results):
+            self.assertAlmostEqual(e.get_result("map"), r.get_result("map"), places=4)
+
+    def test_evaluate_run_by_topic(self):
+        expected = self.teval2.evaluate_all(per_query=True, engine="single_pass")
+        result = procedures.evaluate_run_by_topic(read_run_by_topic("./files/input.uic0301", chunksize=1000),
+                                                  self.teval2.qrels, per_query=True)
+        for metric in ["num_ret", "num_rel", "num_rel_ret", "num_q", "map", "gm_map", "bpref", "Rprec", "P_10", "NDCG_10"]:
+            self.assertAlmostEqual(expected.get_result(metric), result.get_result(metric), places=4)
+        for topic in ["303", "650"]:
+            self.assertAlmostEqual(expected.get_result("map", query=topic), result.get_result("map", query=topic), places=4)
+
+    def test_incremental_eval(self):
+        run = self.teval2.run
+        judgements = [("303", run.get_top_documents("303", n=2)[1], 1), ("303", run.get_top_documents("303", n=5)[4], 0),
+                      ("307", run.get_top_documents("307", n=3)[2], 2), ("650", "not_retrieved", 1)]
+        qrels = TrecQrel()
+        qrels.qrels_data = self.teval2.qrels.qrels_data.copy()
+        incremental = TrecIncrementalEval([run, self.teval3.run], qrels, per_query=True)
+        results = incremental.add_judgements(judgements)
+        self.assertEqual(len(results), 2)
+        self.assertNotAlmostEqual(results[0].get_result("map"), self.teval2.get_map(), places=4)
+
+        for r, result in zip([run, self.teval3.run], results):
+            expected = TrecEval(r, qrels).evaluate_all(per_query=True, engine="single_pass")
+            for metric in ["num_rel", "num_rel_ret", "map", "bpref", "Rprec", "P_10", "NDCG_10"]:
+                self.assertAlmostEqual(expected.get_result(metric), result.get_result(metric), places=4)
+            self.assertAlmostEqual(expected.get_result("map", query="303"), result.get_result("map", query="303"), places=4)
+    def test_update_judgements(self):
+        run = self.teval2.run
+        qrels = TrecQrel()
+        qrels.qrels_data = self.teval2.qrels.qrels_data.copy()
+        teval = TrecEval(run, qrels, qrels_index=qrels.get_qrels_index())
+        teval.evaluate_all(per_query=True, engine="single_pass")
+
+        # A new label for a relevant document, a new non-relevant and new relevant documents, a new topic
+        top = run.get_top_documents("303", n=5)
+        judgements = qrels.add_judgements([("303", top[1], 3), ("303", top[4], 0),
+                                           ("307", run.get_top_documents("307", n=3)[2], 2),
+                                           ("650", "not_retrieved", 1), ("999", "new_topic_doc", 1)])
+
+        # The index of the qrel is updated in place, as if it was built again
+        index = qrels.get_qrels_index()
+        self.assertIs(index, teval.qrels_index)
+        expected = TrecQrelIndex(qrels)
+        self.assertListEqual(list(index.queries), list(expected.queries))
+        self.assertTrue(index.relevant_per_query.equals(expected.relevant_per_query))
+        self.assertTrue(index.nonrelevant_per_query.equals(expected.nonrelevant_per_query))
+        width = expected.ideal_dcg.shape[1]
+        self.assertTrue(np.allclose(index.ideal_dcg[:, :width], expected.ideal_dcg))
+        self.assertTrue(np.array_equal(index.get_judgements(judgements["query"], judgements["docid"]), judgements["rel"]))
+
+        # Only the topics of the judgements are computed again
+        with mock.patch.object(TrecRelevanceMatrix, "get_bpref", autospec=True,
+                               side_effect=TrecRelevanceMatrix.get_bpref) as get_bpref:
+            recomputed = teval.update_judgements(judgements)
+            result = teval.evaluate_all(per_query=True, engine="single_pass").data
+        self.assertListEqual(list(recomputed), ["303", "307", "650"])
+        self.assertEqual(get_bpref.call_count, 1)
+        self.assertListEqual(list(get_bpref.call_args[0][0].queries), ["303", "307", "650"])
+
+        expected = TrecEval(run, qrels).evaluate_all(per_query=True, engine="single_pass").data
+        self.assertEqual(expected.shape, result.shape)
+        expected = expected.set_index(["metric", "query"])["value"]
+        result = result.set_index(["metric", "query"])["value"]
+        self.assertEqual(expected.pop(("runid", "all")), result.pop(("runid", "all")))
+        for key, value in expected.items():
+            self.assertTrue(np.isclose(float(value), float(result.loc[key]), equal_nan=True), key)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,190 @@
+import unittest
+import numpy as np
+import pandas as pd
+from trectools import TrecRun, TrecPool, TrecQrel, TrecEval, TrecPoolMaker, TrecAdaptivePool, procedures, misc
+
+
+class TestTrecPool(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = [TrecRun("./files/r1.run"), TrecRun("./files/r2.run"), TrecRun("./files/r3.run")]
+
+    def tearDown(self):
+        pass
+
+    def test_make_pool_topX(self):
+        pool = TrecPoolMaker().make_pool(self.runs, strategy="topX", topX=2).pool
+        self.assertSetEqual(set(pool.keys()), {"1", "2", "3"})
+        self.assertSetEqual(pool["1"], {"doc1_1", "doc1_2"})
+        self.assertSetEqual(pool["2"], {"doc2_1", "doc2_3"})
+        self.assertSetEqual(pool["3"], {"doc2_1", "doc2_3"})
+
+        pool = TrecPoolMaker().make_pool(self.runs, strategy="topX", topX=10).pool
+        self.assertSetEqual(pool["2"], {"doc2_1", "doc2_2", "doc2_3"})
+        self.assertDictEqual(TrecPoolMaker().make_pool([], strategy="topX").pool, {})
+
+    def test_make_pool_rbp_rrf(self):
+        # r1 and r2 rank doc2_1 and doc2_3 first on topic 2 and 3
+        pool = TrecPoolMaker().make_pool(self.runs, strategy="rbp", topX=2).pool
+        self.assertSetEqual(set(pool.keys()), {1, 2, 3})
+        self.assertSetEqual(pool[2], {"doc2_1", "doc2_3"})
+
+        pool_max = TrecPoolMaker().make_pool(self.runs, strategy="rbp", topX=10, rbp_strategy="max").pool
+        pool_rrf = TrecPoolMaker().make_pool(self.runs, strategy="rrf", topX=10).pool
+        self.assertSetEqual(pool_max[2], {"doc2_1", "doc2_2", "doc2_3"})
+        self.assertDictEqual(pool_max, pool_rrf)
+        self.assertIsNone(TrecPoolMaker().make_pool(self.runs, strategy="rbp", rbp_strategy="min"))
+
+    def test_make_pool_by_topic(self):
+        # Runs with multi-digit topics, split by topic in the order of TrecRun (topics sorted as strings)
+        runs, streams = [], []
+        for i, topics in enumerate([["2", "10", "9"], ["9", "10"]]):
+            run = TrecRun()
+            run.load_run_from_dataframe(pd.DataFrame({"query": topics, "q0": "Q0", "docid": ["d%s_%d" % (t, i) for t in topics],
+                                                      "rank": 1, "score": 1.0, "system": "s"}))
+            runs.append(run)
+            stream = []
+            for topic in sorted(topics):
+                topic_run = TrecRun()
+                topic_run.load_run_from_dataframe(run.run_data[run.run_data["query"] == topic].copy())
+                stream.append(topic_run)
+            streams.append(stream)
+
+        pool = TrecPoolMaker().make_pool_by_topic(streams, strategy="topX", topX=10).pool
+        expected = TrecPoolMaker().make_pool(runs, strategy="topX", topX=10).pool
+        self.assertDictEqual(pool, expected)
+        self.assertSetEqual(pool["10"], set(["d10_0", "d10_1"]))
+
+    def test_compact_pool(self):
+        pool_a = TrecPool({"1": {"d1", "d2", "d3"}, "2": {"d4"}})
+        pool_b = TrecPool({"2": {"d4", "d5"}, "1": {"d3", "d6"}})
+
+        compact_a = pool_a.compact()
+        self.assertTrue(compact_a.is_compact())
+        self.assertFalse(pool_a.is_compact())
+        self.assertListEqual(compact_a.get_size_per_topic(), [3, 1])
+        self.assertEqual(compact_a.get_total_pool_size(), 4)
+        self.assertDictEqual(compact_a.pool, pool_a.pool)
+
+        # Key order does not matter, and compact pools can be mixed with dict pools
+        for a, b in [(pool_a, pool_b), (pool_a.compact(), pool_b), (pool_a, pool_b.compact()), (pool_a.compact(), pool_b.compact())]:
+            self.assertDictEqual(a.minus(b).pool, {"1": {"d1", "d2"}, "2": set()})
+            self.assertDictEqual(a.plus(b).pool, {"1": {"d1", "d2", "d3", "d6"}, "2": {"d4", "d5"}})
+            self.assertDictEqual(a.exclusive(b).pool, {"1": {"d1", "d2", "d6"}, "2": {"d5"}})
+
+        compact_a = pool_a.compact()
+        compact_a.minus(pool_b, inplace=True)
+        self.assertTrue(compact_a.is_compact())
+        self.assertDictEqual(compact_a.pool, {"1": {"d1", "d2"}, "2": set()})
+        self.assertIsNone(pool_a.minus(TrecPool({"1": {"d1"}})))
+
+    def test_compact_pool_changed_through_dict(self):
+        pool_b = TrecPool({"1": {"d3", "d6"}, "2": {"d4"}})
+        compact = TrecPool({"1": {"d1", "d2", "d3"}, "2": {"d4"}}).compact()
+
+        # Changes made to the dict are seen by the sizes and by the pool operations
+        compact.pool["1"].add("d9")
+        self.assertFalse(compact.is_compact())
+        self.assertListEqual(compact.get_size_per_topic(), [4, 1])
+        self.assertDictEqual(compact.minus(pool_b.compact()).pool, {"1": {"d1", "d2", "d9"}, "2": set()})
+        self.assertEqual(compact.compact().get_total_pool_size(), 5)
+
+    def test_get_coverage_matrix(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        coverage = procedures.get_coverage_matrix(self.runs[:2], qrels, cutoffs=[10, 1])
+
+        self.assertListEqual(list(coverage.columns.get_level_values("metric").unique()),
+                             ["judged@1", "unjudged@1", "judged@10", "unjudged@10"])
+        judged = coverage["judged@10"]
+        self.assertListEqual(list(judged.columns), ["1", "2", "3"])
+        self.assertListEqual(list(judged.iloc[0].values[:2]), [3, 3])
+        self.assertTrue(np.isnan(judged.iloc[0]["3"]))
+        self.assertTrue(np.isnan(judged.iloc[1]["2"]))
+        # Topic 3 of r2 has no judged documents
+        self.assertEqual(judged.iloc[1]["3"], 0)
+        self.assertEqual(coverage["unjudged@10"].iloc[1]["3"], 3)
+        self.assertEqual(coverage["unjudged@1"].iloc[1]["3"], 1)
+        self.assertEqual(coverage["judged@1"].iloc[0]["1"], 1)
+
+        # Pools work as well, and get_pool_coverage only averages the topics of each run
+        pool = TrecPoolMaker().make_pool(self.runs[:2], strategy="topX", topX=1)
+        self.assertEqual(procedures.get_coverage_matrix(self.runs, pool)["judged@10"].iloc[2]["2"], 1)
+        self.assertListEqual([m for _, m, _ in procedures.get_pool_coverage(self.runs, qrels, topX=10)], [3.0, 1.5, 3.0])
+        self.assertRaises(ValueError, procedures.get_coverage_matrix, self.runs, qrels, [])
+
+    def test_unique_documents(self):
+        unique = misc.unique_documents(self.runs, cutoff=2, groups=["a", "b", "c"])
+        self.assertListEqual(list(unique.keys()), ["a", "b", "c"])
+        self.assertDictEqual(unique["a"].pool, {})
+        self.assertDictEqual(unique["b"].pool, {"3": {"doc2_1", "doc2_3"}})
+
+        unique = misc.unique_documents(self.runs, cutoff=2, groups=["a", "b", "a"])
+        self.assertDictEqual(unique["a"].pool, {"2": {"doc2_1", "doc2_3"}})
+        self.assertRaises(ValueError, misc.unique_documents, self.runs, 2, ["a"])
+
+    def test_leave_one_out_evaluation(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        result = procedures.leave_one_out_evaluation(self.runs, qrels, cutoff=2, groups=["a", "b", "a"],
+                                                     metrics=["P_10", "map"])
+        self.assertListEqual(list(result["metric"]), ["P_10", "map"] * 3)
+
+        r1 = result.iloc[:2].set_index("metric")
+        self.assertAlmostEqual(r1.loc["P_10", "value"], TrecEval(self.runs[0], qrels).get_precision(10))
+        self.assertAlmostEqual(r1.loc["map", "value"], TrecEval(self.runs[0], qrels).get_map())
+        # Without the judgements of doc2_1 (relevant) and doc2_3, only doc2_2 is relevant in topic 2
+        self.assertAlmostEqual(r1.loc["P_10", "leave_out_value"], 0.1)
+        self.assertEqual(r1.loc["P_10", "unique"], 2)
+        self.assertRaises(ValueError, procedures.leave_one_out_evaluation, self.runs, qrels, 2, None, ["P10"])
+
+    def test_leave_one_out_ndcg_in_run_order(self):
+        # Scores increase down the ranking, so the run order and the trec_eval order differ
+        qrels = TrecQrel("./files/qrel1.txt")
+        run = TrecRun()
+        run.load_run_from_dataframe(pd.DataFrame({"query": "1", "q0": "Q0", "docid": ["doc1_7", "doc1_0", "doc1_2"],
+                                                  "rank": [1, 2, 3], "score": [1.0, 2.0, 3.0], "system": "sys"}))
+
+        result = procedures.leave_one_out_evaluation([run] + self.runs, qrels, cutoff=1, groups=["a", "b", "c", "d"],
+                                                     metrics=["NDCG_10", "map"])
+        values = result[result["runid"] == "sys"].set_index("metric")["value"]
+        expected = TrecEval(run, qrels).evaluate_all(engine="single_pass")
+        self.assertAlmostEqual(values["NDCG_10"], expected.get_result("NDCG_10"))
+        self.assertAlmostEqual(values["map"], expected.get_result("map"))
+        self.assertNotAlmostEqual(values["NDCG_10"], TrecEval(run, qrels).get_relevance_matrix().get_ndcg(10).mean())
+
+    def test_adaptive_pool_mtf(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        pool = TrecAdaptivePool(self.runs, strategy="mtf")
+
+        # r1 keeps proposing documents until it finds a non-relevant one, then r3 (r2 has no topic 2) takes over
+        self.assertEqual(pool.next_document("2"), "doc2_1")
+        pool.record_judgment("2", "doc2_1", qrels.get_judgement("doc2_1", "2"))
+        self.assertEqual(pool.next_document("2"), "doc2_3")
+        pool.record_judgment("2", "doc2_3", qrels.get_judgement("doc2_3", "2"))
+        self.assertEqual(pool.next_document("2"), "doc2_2")
+        self.assertIsNone(pool.next_document("2"))
+        pool.record_judgment("2", "doc2_2", 1)
+
+        self.assertDictEqual(pool.get_pool().pool, {"2": {"doc2_1", "doc2_2", "doc2_3"}})
+        self.assertEqual(len(pool.get_qrels().qrels_data), 3)
+        self.assertIsNone(TrecAdaptivePool(self.runs).next_document("4"))
+        self.assertRaises(ValueError, TrecAdaptivePool, self.runs, "hedge")
+
+    def test_adaptive_pool_bandit(self):
+        qrels = TrecQrel("./files/qrel1.txt")
+        pool = TrecAdaptivePool(self.runs, strategy="bandit", depth=2)
+
+        judged = []
+        document = pool.next_document("1")
+        while document is not None:
+            judged.append(document)
+            pool.record_judgment("1", document, qrels.get_judgement(document, "1"))
+            document = pool.next_document("1")
+        self.assertListEqual(judged, ["doc1_1", "doc1_2"])
+
+        # Documents proposed but not judged yet are not proposed again
+        self.assertEqual(pool.next_document("3"), "doc2_1")
+        self.assertEqual(pool.next_document("3"), "doc2_3")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import pandas as pd
+from trectools import TrecQrel
+
+
+class TestTrecQrel(unittest.TestCase):
+
+    def setUp(self):
+        self.qrel = TrecQrel("./files/qrel1.txt")
+
+    def tearDown(self):
+        pass
+
+    def test_get_judgement(self):
+        self.assertEqual(self.qrel.get_judgement("doc1_7", "1"), 2)
+        self.assertEqual(self.qrel.get_judgement("doc1_0", "1"), 0)
+        self.assertEqual(self.qrel.get_judgement("doc1_7", "2"), -1)
+
+        rels = self.qrel.get_judgements(["doc1_7", "doc2_0", "doc2_0", "docX"], ["1", "2", "3", "1"])
+        self.assertListEqual(list(rels), [2, 1, -1, -1])
+
+    def test_get_document_names_for_topic(self):
+        self.assertSetEqual(set(self.qrel.get_document_names_for_topic("3")), set(["doc3_%d" % i for i in range(10)]))
+        self.assertEqual(len(self.qrel.get_document_names_for_topic("4")), 0)
+
+        # The result is a set that callers can change without changing the qrel
+        documents = self.qrel.get_document_names_for_topic("3")
+        self.assertIsInstance(documents, set)
+        documents.add("doc_new")
+        self.assertNotIn("doc_new", self.qrel.get_document_names_for_topic("3"))
+
+    def test_fill_up(self):
+        # Lookups have to see the judgements added by fill_up
+        self.assertEqual(self.qrel.get_judgement("doc4_1", "4"), -1)
+        another_qrel = TrecQrel()
+        another_qrel.qrels_data = pd.DataFrame({"query": ["4"], "q0": ["0"], "docid": ["doc4_1"], "rel": [1]})
+        self.qrel.fill_up(another_qrel)
+        self.assertEqual(self.qrel.get_judgement("doc4_1", "4"), 1)
+        self.assertSetEqual(set(self.qrel.get_document_names_for_topic("4")), {"doc4_1"})
+        self.assertListEqual(list(self.qrel.get_judgements(["doc4_1"], ["4"])), [1])
+
+    def test_add_judgements(self):
+        added = self.qrel.add_judgements([("1", "doc1_0", 1), ("4", "doc4_1", 2), ("1", "doc1_0", 2)])
+        self.assertEqual(len(added), 2)
+        self.assertEqual(len(self.qrel.qrels_data), 31)
+        self.assertEqual(self.qrel.get_judgement("doc1_0", "1"), 2)
+        self.assertEqual(self.qrel.get_judgement("doc4_1", "4"), 2)
+
+        # Labels are stored as integers, and invalid labels are rejected
+        self.qrel.add_judgements(pd.DataFrame({"query": [3], "docid": ["doc3_0"], "rel": ["1"]}))
+        self.assertEqual(self.qrel.get_judgement("doc3_0", "3"), 1)
+        self.assertEqual(self.qrel.qrels_data["rel"].dtype.kind, "i")
+        for rel in ["R", 0.5, -1, None]:
+            self.assertRaises(ValueError, self.qrel.add_judgements, [("1", "doc1_0", rel)])
+        self.assertEqual(len(self.qrel.qrels_data), 31)
+
+    def test_add_judgements_custom_header(self):
+        # A qrel read with other cols keeps them
+        qrel = TrecQrel("./files/qrel1.txt", qrels_header=["query", "iteration", "docid", "rel"])
+        qrel.add_judgements([("1", "doc1_0", 1), ("5", "doc5_0", 2)])
+        self.assertListEqual(list(qrel.qrels_data.columns), ["query", "iteration", "docid", "rel"])
+        self.assertEqual(qrel.get_judgement("doc5_0", "5"), 2)
+
+        qrel.qrels_data = qrel.qrels_data.rename(columns={"rel": "label"})
+        self.assertRaises(ValueError, qrel.add_judgements, [("1", "doc1_0", 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,12 @@
+import os
+import shutil
+import tempfile
 import unittest
+import numpy as np
+import pandas as pd
 from trectools import TrecRun, TrecQrel
+from trectools import trec_cache
+from trectools.trec_run import read_run_by_topic, align_topics, natural_topic_key
 
 
 class TestTrecRun(unittest.TestCase):
@@ -31,6 +38,122 @@ class TestTrecRun(unittest.TestCase):
         topic2_top2 = self.run.get_top_documents("2", n=2)
         self.assertListEqual(topic1_top2, ["doc1_1", "doc1_2"])
         self.assertListEqual(topic2_top2, ["doc2_1", "doc2_3"])
+        self.assertListEqual(self.run.get_top_documents("3"), [])
+
+        # The topic index follows changes of the run
+        another_run = TrecRun("./files/r2.run")
+        self.run.load_run_from_dataframe(another_run.run_data)
+        self.assertListEqual(self.run.get_top_documents("3", n=2), ["doc2_1", "doc2_3"])
+        self.assertListEqual(self.run.get_top_documents("2"), [])
+
+    def test_read_run_fast(self):
+        for kwargs in [{"fast": True}, {"categorical": True}]:
+            run = TrecRun()
+            run.read_run("./files/r1.run", **kwargs)
+            self.assertListEqual(run.topics(), ["1","2"])
+            self.assertListEqual(run.get_top_documents("2", n=2), ["doc2_1", "doc2_3"])
+            self.assertListEqual(list(run.run_data["docid"]), list(self.run.run_data["docid"]))
+            self.assertListEqual(list(run.run_data["score"]), list(self.run.run_data["score"]))
+
+        run = TrecRun()
+        run.read_run("./files/r1.run", categorical=True)
+        self.assertEqual(run.run_data["docid"].dtype.name, "category")
+
+    def test_read_run_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            runfile = os.path.join(tmpdir, "r1.run")
+            shutil.copy("./files/r1.run", runfile)
+
+            run = TrecRun()
+            run.read_run(runfile, cache=True)
+            self.assertTrue(os.path.isfile(trec_cache.get_sidecar_filename(runfile)))
+            cached = TrecRun()
+            cached.read_run(runfile, cache=True)
+            self.assertTrue(cached.run_data.equals(run.run_data))
+            self.assertListEqual(cached.get_top_documents("2", n=2), ["doc2_1", "doc2_3"])
+
+            # Changing the source file invalidates the sidecar
+            with open(runfile, "a") as f:
+                f.write("3 Q0 doc3_1 1 1.0 r1\n")
+            cached.read_run(runfile, cache=True)
+            self.assertListEqual(cached.topics(), ["1","2","3"])
+
+            qrel = TrecQrel()
+            qrel.read_qrel("./files/qrel1.txt", cache=tmpdir)
+            cached = TrecQrel()
+            cached.read_qrel("./files/qrel1.txt", cache=tmpdir)
+            self.assertTrue(cached.qrels_data.equals(qrel.qrels_data))
+
+            # Fast and categorical runs keep their dtypes
+            for options in [{"fast": True}, {"categorical": True}]:
+                run = TrecRun()
+                run.read_run(runfile, cache=tmpdir, **options)
+                cached = TrecRun()
+                cached.read_run(runfile, cache=tmpdir, **options)
+                self.assertTrue(cached.run_data.equals(run.run_data))
+                self.assertListEqual(list(cached.run_data.dtypes), list(run.run_data.dtypes))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_run_cache_no_pickle(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            runfile = os.path.join(tmpdir, "r1.run")
+            shutil.copy("./files/r1.run", runfile)
+            marker = os.path.join(tmpdir, "marker")
+            open(marker, "w").close()
+
+            # A sidecar with a pickled object that would remove the marker file if it was unpickled
+            class Payload(object):
+                def __reduce__(self):
+                    return (os.remove, (marker,))
+
+            with open(trec_cache.get_sidecar_filename(runfile), "wb") as f:
+                np.savez(f, header=np.array([Payload()], dtype=object))
+
+            run = TrecRun()
+            run.read_run(runfile, cache=True)
+            self.assertTrue(os.path.isfile(marker))
+            self.assertListEqual(list(run.run_data["docid"]), list(self.run.run_data["docid"]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_run_by_topic(self):
+        topic_runs = list(read_run_by_topic("./files/r1.run", chunksize=2))
+        self.assertListEqual([r.topics() for r in topic_runs], [["1"], ["2"]])
+        self.assertListEqual(topic_runs[1].get_top_documents("2", n=2), ["doc2_1", "doc2_3"])
+        self.assertEqual(topic_runs[0].get_runid(), self.run.get_runid())
+
+        aligned = list(align_topics([read_run_by_topic("./files/r1.run"), read_run_by_topic("./files/r2.run")]))
+        self.assertListEqual([topic for topic, runs in aligned], ["1", "2", "3"])
+        self.assertListEqual([len(runs[0].run_data) > 0 for topic, runs in aligned], [True, True, False])
+        # The empty run of a missing topic has the dtypes of a run read from a file
+        empty = aligned[2][1][0].run_data
+        self.assertListEqual([str(t) for t in empty.dtypes], ["object", "object", "object", "int64", "float64", "object"])
+
+    def test_align_topics_order(self):
+        def stream(topics):
+            runs = []
+            for topic in topics:
+                run = TrecRun()
+                run.load_run_from_dataframe(pd.DataFrame({"query": [topic], "q0": ["Q0"], "docid": ["d" + topic],
+                                                          "rank": [1], "score": [1.0], "system": ["s"]}))
+                runs.append(run)
+            return runs
+
+        def aligned_topics(streams, key=None):
+            return [topic for topic, runs in align_topics(streams, key=key)]
+
+        # Topics sorted as strings, as TrecRun writes runs, or numeric topics sorted by value
+        self.assertListEqual(aligned_topics([stream(["10", "2", "9"]), stream(["10", "9"])]), ["10", "2", "9"])
+        self.assertListEqual(aligned_topics([stream(["2", "9", "10"]), stream(["9", "10"])]), ["2", "9", "10"])
+        # The order is only found after reading ahead in the first stream
+        self.assertListEqual(aligned_topics([stream(["2", "10"]), stream(["10"])]), ["2", "10"])
+        self.assertListEqual(aligned_topics([stream(["10", "2"]), stream(["2"])]), ["10", "2"])
+
+        self.assertRaises(ValueError, aligned_topics, [stream(["2", "10", "3"]), stream(["3"])])
+        self.assertRaises(ValueError, aligned_topics, [stream(["10", "2"]), stream(["2"])], natural_topic_key)
 
     def test_get_mean_coverage(self):
         #trecqrel = TrecQrel("./files/qrel1.txt")